@@ -0,0 +1,377 @@
+"""Замеры производительности модуля фитнес-трекера."""
+import argparse
+import asyncio
+import contextlib
+import csv
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from collections import deque
+from itertools import cycle, islice, starmap
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import homework
+
+PACKAGES = [
+    ('SWM', [720, 1, 80, 25, 40]),
+    ('RUN', [15000, 1, 75]),
+    ('WLK', [9000, 1, 75, 180]),
+]
+
+
+def synthetic_packages(count: int):
+    """Вернуть поток из count повторяющихся пакетов."""
+    for index in range(count):
+        yield PACKAGES[index % len(PACKAGES)]
+
+
+def measure(function, *args, **kwargs) -> float:
+    """Вернуть время выполнения функции в секундах."""
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def bench_parallel(count: int = 300_000) -> None:
+    """Сравнить пропускную способность пула на 1 и N процессах."""
+    for workers in sorted({1, os.cpu_count() or 1}):
+        elapsed = measure(
+            lambda: sum(1 for _ in homework.parallel_info(
+                synthetic_packages(count), workers=workers,
+                chunk_size=5000)))
+        print(f'parallel_info workers={workers}: '
+              f'{count / elapsed:,.0f} пакетов/с')
+
+
+def bench_binary_format(count: int = 300_000) -> None:
+    """Сравнить чтение двоичного формата, JSON и CSV."""
+    with tempfile.TemporaryDirectory() as directory:
+        binary = os.path.join(directory, 'packages.bin')
+        json_lines = os.path.join(directory, 'packages.jsonl')
+        csv_rows = os.path.join(directory, 'packages.csv')
+        homework.write_binary_packages(binary, synthetic_packages(count))
+        with open(json_lines, 'w') as file:
+            for package in synthetic_packages(count):
+                file.write(json.dumps(package) + '\n')
+        with open(csv_rows, 'w', newline='') as file:
+            writer = csv.writer(file)
+            for workout_type, data in synthetic_packages(count):
+                writer.writerow([workout_type, *data])
+
+        def read_json():
+            with open(json_lines) as file:
+                for line in file:
+                    json.loads(line)
+
+        def read_csv():
+            with open(csv_rows, newline='') as file:
+                for workout_type, *data in csv.reader(file):
+                    [float(value) for value in data]
+
+        for name, reader in (
+                ('binary', lambda: sum(
+                    1 for _ in homework.read_binary_packages(binary))),
+                ('json', read_json),
+                ('csv', read_csv)):
+            elapsed = measure(reader)
+            print(f'{name}: {count / elapsed:,.0f} пакетов/с')
+
+
+def bench_format(count: int = 1_000_000) -> None:
+    """Сравнить str.format, get_message и пакетное форматирование."""
+    messages = [homework.InfoMessage('Running', 1.5, 5.85, 3.9, 364.084)
+                ] * count
+    info = homework.InfoMessage.info
+
+    def str_format():
+        for message in messages:
+            info.format(training_type=message.training_type,
+                        duration=message.duration,
+                        distance=message.distance,
+                        speed=message.speed,
+                        calories=message.calories)
+
+    def get_message():
+        for message in messages:
+            message.get_message()
+
+    for name, function in (
+            ('str.format', str_format),
+            ('get_message', get_message),
+            ('format_messages', lambda: homework.format_messages(messages))):
+        elapsed = measure(function)
+        print(f'{name}: {count / elapsed:,.0f} сообщений/с')
+
+
+def bench_sink(count: int = 300_000) -> None:
+    """Сравнить построчный print и буферизованный MessageSink."""
+    trainings = [homework.read_package(*package)
+                 for package in synthetic_packages(count)]
+    with open(os.devnull, 'w') as devnull:
+        def per_line():
+            with contextlib.redirect_stdout(devnull):
+                for training in trainings:
+                    homework.main(training)
+
+        def buffered():
+            with homework.MessageSink(devnull, buffer_size=4096) as sink:
+                for training in trainings:
+                    homework.main(training, sink)
+
+        for name, function in (('print', per_line), ('sink', buffered)):
+            elapsed = measure(function)
+            print(f'{name}: {count / elapsed:,.0f} строк/с')
+
+
+def bench_server(connections: int = 1000, requests: int = 20) -> None:
+    """Нагрузить сервер пакетов и вывести задержки p50/p99."""
+    lines = [' '.join(map(str, [workout_type, *data])).encode() + b'\n'
+             for workout_type, data in PACKAGES]
+
+    async def client(port, latencies):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        for index in range(requests):
+            start = time.perf_counter()
+            writer.write(lines[index % len(lines)])
+            await reader.readline()
+            latencies.append(time.perf_counter() - start)
+        writer.close()
+        await writer.wait_closed()
+
+    async def scenario():
+        latencies = []
+        server = await homework.serve()
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            await asyncio.gather(*(client(port, latencies)
+                                   for _ in range(connections)))
+        return latencies
+
+    latencies = asyncio.run(scenario())
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(f'server connections={connections}: '
+          f'p50={percentiles[49] * 1000:.2f} мс, '
+          f'p99={percentiles[98] * 1000:.2f} мс')
+
+
+def legacy_read_package(workout_type: str, data: list):
+    """Исходная read_package: словарь классов собирается на каждый вызов."""
+    type_training = {'SWM': homework.Swimming,
+                     'RUN': homework.Running,
+                     'WLK': homework.SportsWalking}
+    if workout_type in type_training:
+        return type_training[workout_type](*data)
+    raise ValueError('Неизвестный тип тренировки.')
+
+
+def bench_dispatch(count: int = 1_000_000) -> None:
+    """Сравнить стоимость диспетчеризации до и после реестра."""
+    packages = list(synthetic_packages(count))
+    for name, reader in (('legacy', legacy_read_package),
+                         ('registry', homework.read_package)):
+        elapsed = measure(lambda: [reader(*package) for package in packages])
+        print(f'read_package {name}: {elapsed / count * 1e9:.0f} нс/вызов')
+
+
+def replay_packages(count: int, duplicates: float = 0.8, seed: int = 1):
+    """Вернуть повтор с заданной долей одинаковых пакетов."""
+    import random
+
+    rng = random.Random(seed)
+    unique = max(1, int(count * (1 - duplicates)))
+    return [('RUN', [rng.randrange(1000, 20000), 1, 75])
+            for _ in range(unique)] * (count // unique)
+
+
+def bench_disk_cache(count: int = 200_000) -> None:
+    """Сравнить повтор с расчётом и с дисковым кэшем после прогрева."""
+    packages = replay_packages(count)
+    with tempfile.TemporaryDirectory() as directory:
+        with homework.ResultCache(os.path.join(directory, 'cache')) as cache:
+            cache.warm_up(packages[:count // 5])
+            for name, run in (
+                    ('compute', lambda: consume(
+                        homework.stream_info(packages))),
+                    ('disk cache', lambda: consume(
+                        homework.stream_info(packages, cache))),
+                    ('loaded cache', lambda: cache.load() and consume(
+                        homework.stream_info(packages, cache)))):
+                elapsed = measure(run)
+                print(f'replay {name}: {len(packages) / elapsed:,.0f} '
+                      'пакетов/с')
+
+
+def bench_export(count: int = 500_000) -> None:
+    """Сравнить колоночную выгрузку с записью строк get_message()."""
+    messages = list(islice(cycle(homework.stream_info(PACKAGES)), count))
+    with tempfile.TemporaryDirectory() as directory:
+        def text():
+            with open(os.path.join(directory, 'results.txt'), 'w') as file:
+                file.write(homework.format_messages(messages))
+
+        writers = [
+            ('get_message', text),
+            ('columnar', lambda: homework.write_columnar(
+                os.path.join(directory, 'results.col'), messages)),
+        ]
+        if importlib.util.find_spec('pyarrow'):
+            writers.append(('parquet', lambda: homework.write_parquet(
+                os.path.join(directory, 'results.parquet'), messages)))
+        for name, writer in writers:
+            elapsed = measure(writer)
+            print(f'export {name}: {count / elapsed:,.0f} записей/с')
+
+
+def bench_threads(count: int = 300_000) -> None:
+    """Показать масштабирование потокового драйвера от 1 до N потоков."""
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print(f'GIL {"включён" if gil else "выключен"}')
+    threads = 1
+    while threads <= (os.cpu_count() or 1):
+        elapsed = measure(lambda: consume(homework.threaded_messages(
+            synthetic_packages(count), threads, chunk_size=2000)))
+        print(f'threaded_messages threads={threads}: '
+              f'{count / elapsed:,.0f} пакетов/с')
+        threads *= 2
+
+
+def bench_shared_results(count: int = 500_000) -> None:
+    """Сравнить чтение результатов в родителе: pickle и общая память."""
+    import pickle
+
+    messages = list(homework.stream_info(
+        ('RUN', [action, 1, 75]) for action in range(count)))
+    payload = pickle.dumps(messages)
+
+    with homework.SharedResults(count) as results:
+        results.write(0, messages)
+        for name, reader in (
+                ('pickle calories', lambda: sum(
+                    info.calories for info in pickle.loads(payload))),
+                ('shared calories', lambda: sum(
+                    view.calories for view in results.views(0, count))),
+                ('pickle get_message', lambda: consume(
+                    info.get_message() for info in pickle.loads(payload))),
+                ('shared get_message', lambda: consume(
+                    view.get_message() for view in results.views(0, count)))):
+            elapsed = measure(reader)
+            print(f'parent {name}: {count / elapsed:,.0f} записей/с')
+
+
+def bench_generator(count: int = 5_000_000) -> None:
+    """Измерить скорость генерации синтетических пакетов."""
+    generator = homework.PackageGenerator(seed=1, duplicate_rate=0.1,
+                                          malformed_rate=0.01)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'packages.bin')
+        for name, run in (
+                ('binary', lambda: generator.write_binary(path, count)),
+                ('packages', lambda: consume(
+                    generator.packages(count // 5)))):
+            size = count if name == 'binary' else count // 5
+            elapsed = measure(run)
+            print(f'generator {name}: {size / elapsed * 60:,.0f} '
+                  'пакетов/мин')
+
+
+COMPARISONS = [bench_parallel, bench_binary_format, bench_format,
+               bench_sink, bench_server, bench_dispatch, bench_disk_cache,
+               bench_export, bench_threads, bench_shared_results,
+               bench_generator]
+
+
+def consume(items: Iterable) -> None:
+    """Исчерпать итератор без накопления результатов."""
+    deque(items, maxlen=0)
+
+
+def hot_paths() -> Dict[str, Tuple[list, Callable[[Iterable], None]]]:
+    """Вернуть горячие пути: пул входных данных и функцию прогона.
+
+    Методы тренировки замеряются на новом экземпляре в каждой итерации,
+    поэтому в их время входит и стоимость конструктора (см. construct_*).
+    """
+    trainings = [homework.read_package(*package) for package in PACKAGES]
+    infos = [training.show_training_info() for training in trainings]
+    builds = [(type(training), data)
+              for (_, data), training in zip(PACKAGES, trainings)]
+
+    def main_loop(items):
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            for workout_type, data in items:
+                homework.main(homework.read_package(workout_type, data))
+
+    cases = {
+        'read_package': (PACKAGES, lambda items: consume(
+            starmap(homework.read_package, items))),
+    }
+    for training_class, data in builds:
+        name = training_class.__name__
+        cases[f'construct_{name}'] = ([data], lambda items, cls=training_class:
+                                      consume(starmap(cls, items)))
+        cases[f'get_spent_calories_{name}'] = (
+            [(training_class, data)], lambda items: consume(
+                cls(*data).get_spent_calories() for cls, data in items))
+    cases.update({
+        'show_training_info': (builds, lambda items: consume(
+            cls(*data).show_training_info() for cls, data in items)),
+        'get_message': (infos, lambda items: consume(
+            map(homework.InfoMessage.get_message, items))),
+        'main': (PACKAGES, main_loop),
+    })
+    return cases
+
+
+def run_suite(sizes: List[int], repeat: int = 3,
+              names: Iterable[str] = ()) -> List[dict]:
+    """Прогнать горячие пути на каждом размере и вернуть результаты."""
+    results = []
+    for name, (pool, run) in hot_paths().items():
+        if names and name not in names:
+            continue
+        for size in sizes:
+            seconds = min(measure(run, islice(cycle(pool), size))
+                          for _ in range(repeat))
+            results.append({'name': name, 'size': size, 'seconds': seconds,
+                            'ns_per_op': seconds / size * 1e9})
+            print(f'{name} n={size}: {seconds / size * 1e9:.0f} нс/оп',
+                  file=sys.stderr)
+    return results
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    """Разобрать аргументы командной строки."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1_000, 10_000, 100_000],
+                        help='число пакетов, до 10_000_000')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='*', default=(),
+                        help='прогнать только указанные пути')
+    parser.add_argument('--output', default='bench_output.json',
+                        help='файл для результатов в формате JSON')
+    parser.add_argument('--compare', action='store_true',
+                        help='дополнительно запустить сравнительные замеры')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'created': time.time(),
+        'results': run_suite(args.sizes, args.repeat, args.only),
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    if args.compare:
+        for comparison in COMPARISONS:
+            comparison()
@@ -1,8 +1,59 @@
-from dataclasses import dataclass
-from typing import ClassVar
+import heapq
+import math
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import MISSING, dataclass, field, fields
+from functools import lru_cache, wraps
+from itertools import islice
+from operator import attrgetter
+from string import Formatter
+from types import MappingProxyType
+from typing import (TYPE_CHECKING, Callable, ClassVar, Deque, Dict,
+                    Iterable, Iterator, List, Mapping, Optional, TextIO,
+                    Tuple)
 
+if TYPE_CHECKING:
+    import asyncio
+    from concurrent.futures import Future
 
-@dataclass
+    import numpy as np
+
+
+def import_numpy():
+    """Импортировать numpy при первом обращении к пакетному режиму."""
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('Для пакетной обработки требуется numpy.') from None
+    return numpy
+
+
+def compile_template(template: str) -> Tuple[str, Tuple[str, ...]]:
+    """Преобразовать шаблон str.format в %-шаблон и порядок полей."""
+    parts, names = [], []
+    for literal, name, spec, conversion in Formatter().parse(template):
+        parts.append(literal.replace('%', '%%'))
+        if name is None:
+            continue
+        if conversion or not name.isidentifier():
+            raise ValueError(f'Поле шаблона не поддерживается: {name}')
+        parts.append(f'%{spec}' if spec else '%s')
+        names.append(name)
+    return ''.join(parts), tuple(names)
+
+
+_instrumentation: Optional['Instrumentation'] = None
+
+
+@dataclass(slots=True, frozen=True)
 class InfoMessage:
     """Информационное сообщение о тренировке."""
     training_type: str
@@ -15,14 +66,77 @@ class InfoMessage:
                       'Дистанция:{distance: .3f} км; '
                       'Ср. скорость:{speed: .3f} км/ч; '
                       'Потрачено ккал:{calories: .3f}.')
+    template, names = compile_template(info)
+    values = attrgetter(*names)
 
     def get_message(self) -> str:
         """Получить сообщение о тренировке."""
-        return self.info.format(training_type=self.training_type,
-                                duration=self.duration,
-                                distance=self.distance,
-                                speed=self.speed,
-                                calories=self.calories)
+        if _instrumentation is None:
+            return self.template % self.values(self)
+        with _instrumentation.measure('format', self.training_type):
+            return self.template % self.values(self)
+
+
+def format_messages(messages: Iterable[InfoMessage]) -> str:
+    """Отрисовать сообщения в один текстовый буфер, по строке на каждое."""
+    line = InfoMessage.template + '\n'
+    values = InfoMessage.values
+    if _instrumentation is None:
+        return ''.join([line % values(message) for message in messages])
+    messages = list(messages)
+    with _instrumentation.measure('format', 'batch', len(messages)):
+        return ''.join([line % values(message) for message in messages])
+
+
+def package_fields(training_class: type) -> Tuple[str, ...]:
+    """Вернуть имена полей пакета в порядке аргументов конструктора."""
+    return tuple(item.name for item in fields(training_class) if item.init)
+
+
+def package_arity(training_class: type) -> Tuple[int, int]:
+    """Вернуть наименьшее и наибольшее число значений в пакете."""
+    init_fields = [item for item in fields(training_class) if item.init]
+    required = sum(item.default is MISSING
+                   and item.default_factory is MISSING
+                   for item in init_fields)
+    return required, len(init_fields)
+
+
+PACKAGE_MAGIC = b'FTPKG\x00\x00\x01'
+PACKAGE_RECORD = struct.Struct('<3s5d')
+PACKAGE_FIELDS = 5
+
+TRAINING_TYPES: Dict[str, type] = {}
+_TRAINING_ARITY: Dict[str, Tuple[int, int]] = {}
+
+
+def register_training(code: str) -> Callable[[type], type]:
+    """Зарегистрировать класс тренировки под кодом пакета."""
+    if len(code) != 3 or not code.isascii():
+        raise ValueError('Код тренировки должен состоять из 3 символов '
+                         'ASCII.')
+
+    def decorator(training_class: type) -> type:
+        arity = package_arity(training_class)
+        if arity[1] > PACKAGE_FIELDS:
+            raise ValueError('В пакете не может быть больше '
+                             f'{PACKAGE_FIELDS} полей.')
+        TRAINING_TYPES[code] = training_class
+        _TRAINING_ARITY[code] = arity
+        return training_class
+    return decorator
+
+
+def package_class(workout_type: str, data: list) -> type:
+    """Найти класс тренировки для пакета, проверив число значений."""
+    try:
+        training_class = TRAINING_TYPES[workout_type]
+        required, total = _TRAINING_ARITY[workout_type]
+    except KeyError:
+        raise ValueError('Неизвестный тип тренировки.') from None
+    if not required <= len(data) <= total:
+        raise ValueError('Неверное количество данных в пакете.')
+    return training_class
 
 
 @dataclass
@@ -31,9 +145,9 @@ class Training:
     LEN_STEP: ClassVar = 0.65
     M_IN_KM: ClassVar = 1000
     TIME_M: ClassVar = 60
-    action: int
-    duration: float
-    weight: float
+    action: int = field(metadata={'minimum': 0})
+    duration: float = field(metadata={'exclusive_minimum': 0})
+    weight: float = field(metadata={'exclusive_minimum': 0})
 
     def get_distance(self) -> float:
         """Получить дистанцию в км."""
@@ -49,12 +163,17 @@ class Training:
 
     def show_training_info(self) -> InfoMessage:
         """Вернуть информационное сообщение о выполненной тренировке."""
+        if _instrumentation is None:
+            calories = self.get_spent_calories()
+        else:
+            with _instrumentation.measure('compute', type(self).__name__):
+                calories = self.get_spent_calories()
         return InfoMessage(type(self).__name__,
                            self.duration, self.get_distance(),
-                           self.get_mean_speed(),
-                           self.get_spent_calories())
+                           self.get_mean_speed(), calories)
 
 
+@register_training('RUN')
 @dataclass
 class Running(Training):
     """Тренировка: бег."""
@@ -69,6 +188,7 @@ class Running(Training):
                 / self.M_IN_KM * (self.duration * self.TIME_M))
 
 
+@register_training('WLK')
 @dataclass
 class SportsWalking(Training):
     """Тренировка: спортивная ходьба."""
@@ -76,7 +196,7 @@ class SportsWalking(Training):
     COF_2: ClassVar = 0.029
     KM_H_IN_M_C: ClassVar = 0.278
     HEIGHT_M: ClassVar = 100
-    height: float
+    height: float = field(metadata={'exclusive_minimum': 0})
 
     def get_spent_calories(self) -> float:
         """Получить количество затраченных калорий."""
@@ -86,14 +206,15 @@ class SportsWalking(Training):
                  * self.COF_2 * self.weight) * self.duration * self.TIME_M)
 
 
+@register_training('SWM')
 @dataclass
 class Swimming(Training):
     """Тренировка: плавание."""
     LEN_STEP: ClassVar = 1.38
     SWIM_SPEED_COF: ClassVar = 1.1
     SWIM_WEIGHT_COF: ClassVar = 2
-    length_pool: float
-    count_pool: int
+    length_pool: float = field(metadata={'minimum': 0})
+    count_pool: int = field(metadata={'minimum': 0})
 
     def get_mean_speed(self) -> float:
         """Получить среднюю скорость движения."""
@@ -106,30 +227,1531 @@ class Swimming(Training):
                 * self.SWIM_WEIGHT_COF * self.weight * self.duration)
 
 
+COMPACT_MEMOIZED = ('get_mean_speed',)
+
+
+def memoized(method: Callable) -> Callable:
+    """Кэшировать результат метода в слоте неизменяемого экземпляра."""
+    slot = f'_{method.__name__}'
+    cached = attrgetter(slot)
+
+    @wraps(method)
+    def wrapper(self):
+        value = cached(self)
+        if value is None:
+            value = method(self)
+            object.__setattr__(self, slot, value)
+        return value
+    return wrapper
+
+
+@lru_cache(maxsize=None)
+def compact_type(training_class: type) -> type:
+    """Построить вариант класса тренировки на __slots__ без __dict__.
+
+    Вариант называется Compact<Класс> и доступен как атрибут модуля,
+    поэтому его экземпляры можно передавать в другие процессы. Имя
+    __name__ остаётся именем вида тренировки для InfoMessage. Экземпляры
+    неизменяемы, поэтому средняя скорость кэшируется в своём слоте.
+    """
+    namespace = {}
+    for klass in reversed(training_class.__mro__[:-1]):
+        namespace.update((name, value) for name, value in vars(klass).items()
+                         if not name.startswith('__'))
+    namespace.update((item.name, field(default=item.default, init=False,
+                                       repr=False, compare=False))
+                     for item in fields(training_class) if not item.init)
+    annotations = {item.name: item.type for item in fields(training_class)}
+    for name in COMPACT_MEMOIZED:
+        namespace[name] = memoized(namespace[name])
+        namespace[f'_{name}'] = field(default=None, init=False, repr=False,
+                                      compare=False)
+        annotations[f'_{name}'] = Optional[float]
+    namespace.update(
+        __annotations__=annotations,
+        __doc__=training_class.__doc__,
+        __module__=__name__,
+        __qualname__=f'Compact{training_class.__name__}',
+    )
+    return dataclass(slots=True, frozen=True)(
+        type(training_class.__name__, (), namespace))
+
+
+def read_compact_package(workout_type: str, data: list):
+    """Прочитать пакет в компактный неизменяемый объект тренировки."""
+    return compact_type(package_class(workout_type, data))(*data)
+
+
+def __getattr__(name: str) -> type:
+    """Найти компактный вариант зарегистрированной тренировки по имени."""
+    for training_class in TRAINING_TYPES.values():
+        if name == f'Compact{training_class.__name__}':
+            return compact_type(training_class)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def compute_batch(workout_type: str,
+                  columns: Mapping[str, 'np.ndarray']
+                  ) -> Tuple['np.ndarray', 'np.ndarray', 'np.ndarray']:
+    """Рассчитать дистанцию, скорость и калории для массива пакетов."""
+    np = import_numpy()
+    if workout_type not in TRAINING_TYPES:
+        raise ValueError('Неизвестный тип тренировки.')
+    training_class = TRAINING_TYPES[workout_type]
+    training = training_class(*(np.asarray(columns[name], dtype=float)
+                                for name in package_fields(training_class)))
+    return (training.get_distance(),
+            training.get_mean_speed(),
+            training.get_spent_calories())
+
+
+@dataclass
+class TraceTraining:
+    """Тренировка по записи датчика: отсчёты времени и счётчики."""
+    SECONDS_IN_HOUR: ClassVar = 3600
+    workout_type: str
+    timestamps: 'np.ndarray'
+    counters: Mapping[str, 'np.ndarray']
+    params: Mapping[str, float]
+    segment_seconds: Optional[float] = None
+
+    def get_boundaries(self) -> 'np.ndarray':
+        """Получить индексы отсчётов на границах сегментов."""
+        np = import_numpy()
+        timestamps = np.asarray(self.timestamps, dtype=float)
+        if (timestamps.ndim != 1 or len(timestamps) < 2
+                or np.any(np.diff(timestamps) <= 0)):
+            raise ValueError('Отсчёты времени должны строго возрастать.')
+        if self.segment_seconds is None:
+            return np.arange(len(timestamps))
+        buckets = np.floor((timestamps - timestamps[0])
+                           / self.segment_seconds)
+        edges = np.flatnonzero(np.diff(buckets)) + 1
+        return np.unique(np.concatenate(([0], edges,
+                                         [len(timestamps) - 1])))
+
+    def build(self, index: 'np.ndarray') -> Training:
+        """Собрать тренировку из приращений между отсчётами index."""
+        np = import_numpy()
+        if self.workout_type not in TRAINING_TYPES:
+            raise ValueError('Неизвестный тип тренировки.')
+        training_class = TRAINING_TYPES[self.workout_type]
+        columns = {name: np.diff(np.asarray(values, dtype=float)[index])
+                   for name, values in self.counters.items()}
+        columns['duration'] = (np.diff(np.asarray(self.timestamps,
+                                                  dtype=float)[index])
+                               / self.SECONDS_IN_HOUR)
+        names = package_fields(training_class)
+        missing = set(names) - columns.keys() - self.params.keys()
+        if missing:
+            raise ValueError(f'Не заданы поля тренировки: {missing}')
+        return training_class(*(
+            columns[name] if name in columns
+            else np.full(len(columns['duration']), float(self.params[name]))
+            for name in names))
+
+    def get_segments(self) -> Training:
+        """Получить тренировку, поля которой — массивы по сегментам."""
+        return self.build(self.get_boundaries())
+
+    def get_speed_profile(self) -> 'np.ndarray':
+        """Получить среднюю скорость на каждом сегменте."""
+        return self.get_segments().get_mean_speed()
+
+    def show_training_info(self) -> InfoMessage:
+        """Свести запись к стандартному сообщению о тренировке."""
+        boundaries = self.get_boundaries()
+        segments = self.build(boundaries)
+        total = self.build(boundaries[[0, -1]])
+        return InfoMessage(type(total).__name__,
+                           float(total.duration[0]),
+                           float(segments.get_distance().sum()),
+                           float(total.get_mean_speed()[0]),
+                           float(segments.get_spent_calories().sum()))
+
+
+@lru_cache(maxsize=None)
+def package_defaults(training_class: type) -> tuple:
+    """Вернуть значения по умолчанию необязательных полей пакета."""
+    return tuple(item.default if item.default is not MISSING
+                 else item.default_factory()
+                 for item in fields(training_class)
+                 if item.init and (item.default is not MISSING
+                                   or item.default_factory is not MISSING))
+
+
+def pack_package(workout_type: str, data: list) -> bytes:
+    """Упаковать пакет в двоичную запись, дополнив опущенные поля."""
+    defaults = package_defaults(package_class(workout_type, data))
+    missing = _TRAINING_ARITY[workout_type][1] - len(data)
+    if missing:
+        data = (*data, *defaults[len(defaults) - missing:])
+    return PACKAGE_RECORD.pack(workout_type.encode('ascii'), *data,
+                               *(0.0,) * (PACKAGE_FIELDS - len(data)))
+
+
+def package_key(workout_type: str, data: list) -> bytes:
+    """Получить стабильный 16-байтный хэш двоичной записи пакета."""
+    import hashlib
+
+    return hashlib.blake2b(pack_package(workout_type, data),
+                           digest_size=16).digest()
+
+
+def write_binary_packages(path: str,
+                          packages: Iterable[Tuple[str, list]]) -> int:
+    """Записать пакеты в двоичный файл записей фиксированной длины."""
+    count = 0
+    with open(path, 'wb') as file:
+        file.write(PACKAGE_MAGIC)
+        for workout_type, data in packages:
+            file.write(pack_package(workout_type, data))
+            count += 1
+    return count
+
+
+def unpack_packages(data: bytes) -> Iterator[Tuple[str, List[float]]]:
+    """Лениво разобрать пакеты из буфера в двоичном формате пакетов."""
+    if data[:len(PACKAGE_MAGIC)] != PACKAGE_MAGIC:
+        raise ValueError('Неверный формат файла пакетов.')
+    if (len(data) - len(PACKAGE_MAGIC)) % PACKAGE_RECORD.size:
+        raise ValueError('Файл пакетов обрезан на середине записи.')
+    arity = {code.encode('ascii'): total
+             for code, (_, total) in _TRAINING_ARITY.items()}
+    for offset in range(len(PACKAGE_MAGIC), len(data), PACKAGE_RECORD.size):
+        code, *values = PACKAGE_RECORD.unpack_from(data, offset)
+        if code not in arity:
+            raise ValueError('Неизвестный тип тренировки.')
+        yield code.decode(), values[:arity[code]]
+
+
+def read_binary_packages(path: str) -> Iterator[Tuple[str, List[float]]]:
+    """Лениво прочитать пакеты из двоичного файла через mmap."""
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0,
+                                             access=mmap.ACCESS_READ) as data:
+        yield from unpack_packages(data)
+
+
+def package_dtype() -> 'np.dtype':
+    """Получить тип numpy, совпадающий с двоичной записью пакета."""
+    np = import_numpy()
+    return np.dtype([('code', 'S3'), ('data', '<f8', (PACKAGE_FIELDS,))])
+
+
+def memmap_binary_packages(path: str) -> 'np.ndarray':
+    """Отобразить двоичный файл пакетов в структурированный массив."""
+    np = import_numpy()
+    return np.memmap(path, dtype=package_dtype(), mode='r',
+                     offset=len(PACKAGE_MAGIC))
+
+
+def binary_columns(records: 'np.ndarray',
+                   workout_type: str) -> Mapping[str, 'np.ndarray']:
+    """Выбрать из массива пакетов колонки для compute_batch."""
+    if workout_type not in TRAINING_TYPES:
+        raise ValueError('Неизвестный тип тренировки.')
+    selected = records['data'][records['code'] == workout_type.encode()]
+    return {name: selected[:, index] for index, name
+            in enumerate(package_fields(TRAINING_TYPES[workout_type]))}
+
+
+RESULTS_MAGIC = b'FTCOL\x00\x00\x01'
+RESULTS_HEADER = struct.Struct('<IH')
+RESULTS_NAME = struct.Struct('<H')
+
+
+def _little_endian(column: array) -> bytes:
+    """Получить байты колонки в порядке little-endian."""
+    if sys.byteorder != 'little':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _encode_row_group(messages: List[InfoMessage]) -> bytes:
+    """Закодировать группу сообщений в колонки фиксированной ширины."""
+    training_types, *values = zip(*map(InfoMessage.values, messages))
+    names: Dict[str, int] = {}
+    codes = array('H', [names.setdefault(name, len(names))
+                        for name in training_types])
+    parts = [RESULTS_HEADER.pack(len(messages), len(names))]
+    for name in names:
+        encoded = name.encode()
+        parts.append(RESULTS_NAME.pack(len(encoded)) + encoded)
+    parts.append(_little_endian(codes))
+    parts.extend(_little_endian(array('d', column)) for column in values)
+    return b''.join(parts)
+
+
+def write_columnar(path: str, messages: Iterable[InfoMessage],
+                   row_group_size: int = 65536) -> int:
+    """Записать сообщения колонками группами строк, вернуть их число."""
+    count = 0
+    with open(path, 'wb') as file:
+        file.write(RESULTS_MAGIC)
+        for group in chunked(messages, row_group_size):
+            file.write(_encode_row_group(group))
+            count += len(group)
+    return count
+
+
+def _read_column(file, typecode: str, rows: int) -> array:
+    """Прочитать колонку из rows значений."""
+    column = array(typecode)
+    column.frombytes(file.read(column.itemsize * rows))
+    if sys.byteorder != 'little':
+        column.byteswap()
+    return column
+
+
+def read_columnar(path: str) -> Iterator[Dict[str, object]]:
+    """Лениво прочитать группы строк как словари колонок."""
+    with open(path, 'rb') as file:
+        if file.read(len(RESULTS_MAGIC)) != RESULTS_MAGIC:
+            raise ValueError('Неверный формат файла результатов.')
+        while header := file.read(RESULTS_HEADER.size):
+            rows, count = RESULTS_HEADER.unpack(header)
+            names = []
+            for _ in range(count):
+                (size,) = RESULTS_NAME.unpack(file.read(RESULTS_NAME.size))
+                names.append(file.read(size).decode())
+            group = {'training_type': [
+                names[code] for code in _read_column(file, 'H', rows)]}
+            for name in package_fields(InfoMessage)[1:]:
+                group[name] = _read_column(file, 'd', rows)
+            yield group
+
+
+def write_parquet(path: str, messages: Iterable[InfoMessage],
+                  row_group_size: int = 65536) -> int:
+    """Записать сообщения в Parquet через pyarrow группами строк."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Для записи Parquet требуется pyarrow.') from None
+    names = package_fields(InfoMessage)
+    schema = pyarrow.schema(
+        [(names[0], pyarrow.dictionary(pyarrow.int16(), pyarrow.string()))]
+        + [(name, pyarrow.float64()) for name in names[1:]])
+    count = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for group in chunked(messages, row_group_size):
+            columns = list(zip(*map(InfoMessage.values, group)))
+            writer.write_table(pyarrow.table(
+                [pyarrow.array(columns[0]).dictionary_encode().cast(
+                    schema.field(0).type)]
+                + [pyarrow.array(column, pyarrow.float64())
+                   for column in columns[1:]], schema=schema))
+            count += len(group)
+    return count
+
+
+@dataclass
+class PackageGenerator:
+    """Воспроизводимый генератор синтетических пакетов для нагрузки."""
+    RANGES: ClassVar = {
+        'RUN': {'action': (1000, 20000), 'duration': (0.25, 3),
+                'weight': (45, 120)},
+        'WLK': {'action': (1000, 15000), 'duration': (0.25, 3),
+                'weight': (45, 120), 'height': (150, 200)},
+        'SWM': {'action': (100, 2000), 'duration': (0.25, 2),
+                'weight': (45, 120), 'length_pool': (25, 50),
+                'count_pool': (10, 80)},
+    }
+    seed: int = 0
+    mix: Mapping[str, float] = field(
+        default_factory=lambda: {'RUN': 0.5, 'WLK': 0.3, 'SWM': 0.2})
+    ranges: Mapping[str, Mapping[str, Tuple[float, float]]] = field(
+        default_factory=lambda: PackageGenerator.RANGES)
+    duplicate_rate: float = 0.0
+    malformed_rate: float = 0.0
+    chunk_size: int = 65536
+
+    def fill(self, rng, batch: 'np.ndarray', rows: 'np.ndarray',
+             workout_type: str) -> None:
+        """Заполнить строки rows значениями полей вида тренировки."""
+        np = import_numpy()
+        batch['code'][rows] = workout_type.encode('ascii')
+        for column, item in enumerate(
+                item for item in fields(TRAINING_TYPES[workout_type])
+                if item.init):
+            low, high = self.ranges[workout_type][item.name]
+            values = rng.uniform(low, high, len(rows))
+            batch['data'][rows, column] = (np.floor(values)
+                                           if item.type is int else values)
+
+    def spoil(self, rng, batch: 'np.ndarray') -> None:
+        """Испортить и продублировать часть строк порции."""
+        np = import_numpy()
+        rows = np.flatnonzero(rng.random(len(batch)) < self.malformed_rate)
+        batch['data'][rows, rng.integers(1, 3, len(rows))] = rng.choice(
+            [0.0, -1.0, np.nan], len(rows))
+        duplicates = rng.random(len(batch)) < self.duplicate_rate
+        originals = np.flatnonzero(~duplicates)
+        rows = np.flatnonzero(duplicates)
+        before = np.searchsorted(originals, rows)
+        rows, before = rows[before > 0], before[before > 0]
+        batch[rows] = batch[originals[
+            (rng.random(len(rows)) * before).astype(np.int64)]]
+
+    def records(self, count: int) -> Iterator['np.ndarray']:
+        """Порциями сгенерировать записи в двоичном формате пакетов."""
+        np = import_numpy()
+        rng = np.random.default_rng(self.seed)
+        codes = list(self.mix)
+        weights = np.array([self.mix[code] for code in codes], dtype=float)
+        for start in range(0, count, self.chunk_size):
+            batch = np.zeros(min(self.chunk_size, count - start),
+                             package_dtype())
+            kinds = rng.choice(len(codes), len(batch),
+                               p=weights / weights.sum())
+            for kind, workout_type in enumerate(codes):
+                self.fill(rng, batch, np.flatnonzero(kinds == kind),
+                          workout_type)
+            self.spoil(rng, batch)
+            yield batch
+
+    def packages(self, count: int) -> Iterator[Tuple[str, List[float]]]:
+        """Сгенерировать поток пакетов для read_package."""
+        arity = {code.encode(): len(package_fields(training_class))
+                 for code, training_class in TRAINING_TYPES.items()}
+        for batch in self.records(count):
+            for code, data in zip(batch['code'].tolist(),
+                                  batch['data'].tolist()):
+                yield code.decode(), data[:arity[code]]
+
+    def columns(self, count: int
+                ) -> Iterator[Tuple[str, Mapping[str, 'np.ndarray']]]:
+        """Сгенерировать колонки для compute_batch по видам тренировок."""
+        for batch in self.records(count):
+            for workout_type in self.mix:
+                yield workout_type, binary_columns(batch, workout_type)
+
+    def write_binary(self, path: str, count: int) -> int:
+        """Записать count пакетов в двоичный файл пакетов."""
+        with open(path, 'wb') as file:
+            file.write(PACKAGE_MAGIC)
+            for batch in self.records(count):
+                file.write(batch.tobytes())
+        return count
+
+
 def read_package(workout_type: str, data: list) -> Training:
     """Прочитать данные полученные от датчиков."""
-    type_training = {'SWM': Swimming,
-                     'RUN': Running,
-                     'WLK': SportsWalking}
-    if workout_type in type_training:
-        return type_training[workout_type](*data)
-    raise ValueError('Неизвестный тип тренировки.')
+    training_class = package_class(workout_type, data)
+    if _instrumentation is None:
+        return training_class(*data)
+    with _instrumentation.measure('parse', training_class.__name__):
+        return training_class(*data)
+
+
+@lru_cache(maxsize=None)
+def package_schema(training_class: type
+                   ) -> Tuple[Tuple[str, float, bool], ...]:
+    """Собрать схему полей пакета: имя, нижняя граница, строгость."""
+    schema = []
+    for item in fields(training_class):
+        if item.init:
+            exclusive = 'exclusive_minimum' in item.metadata
+            minimum = item.metadata.get(
+                'exclusive_minimum', item.metadata.get('minimum', -math.inf))
+            schema.append((item.name, minimum, exclusive))
+    return tuple(schema)
+
+
+@dataclass
+class PackageValidator:
+    """Проверка пакетов по схеме с очередью отбракованных записей."""
+    dead_letters: List[Tuple[str, list, str]] = field(default_factory=list)
+
+    def check(self, workout_type: str, data: list) -> Optional[str]:
+        """Вернуть причину отказа или None для корректного пакета."""
+        if workout_type not in TRAINING_TYPES:
+            return 'Неизвестный тип тренировки.'
+        schema = package_schema(TRAINING_TYPES[workout_type])
+        if len(data) != len(schema):
+            return 'Неверное количество данных в пакете.'
+        for value, (name, minimum, exclusive) in zip(data, schema):
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                return f'Поле {name} должно быть числом.'
+            if (not math.isfinite(value) or value < minimum
+                    or exclusive and value == minimum):
+                return f'Поле {name} вне допустимого диапазона.'
+        return None
+
+    def validate(self, packages: Iterable[Tuple[str, list]]
+                 ) -> Iterator[Tuple[str, list]]:
+        """Пропустить корректные пакеты, отложив остальные."""
+        for workout_type, data in packages:
+            reason = self.check(workout_type, data)
+            if reason is None:
+                yield workout_type, data
+            else:
+                self.dead_letters.append((workout_type, data, reason))
+
+    def reject_mask(self, workout_type: str,
+                    columns: Mapping[str, 'np.ndarray']) -> 'np.ndarray':
+        """Вернуть маску отбракованных строк для колонок compute_batch."""
+        np = import_numpy()
+        if workout_type not in TRAINING_TYPES:
+            raise ValueError('Неизвестный тип тренировки.')
+        mask = None
+        for name, minimum, exclusive in package_schema(
+                TRAINING_TYPES[workout_type]):
+            column = np.asarray(columns[name], dtype=float)
+            rejected = ~np.isfinite(column) | (
+                column <= minimum if exclusive else column < minimum)
+            mask = rejected if mask is None else mask | rejected
+        return mask
+
+
+def parse_package(line: str) -> Tuple[str, List[float]]:
+    """Разобрать строку пакета вида `SWM 420 4 20 42 4`."""
+    workout_type, *data = line.split()
+    return workout_type, [float(value) for value in data]
+
+
+def read_packages(lines: Iterable[str],
+                  dead_letters: Optional[List[Tuple[str, list, str]]] = None
+                  ) -> Iterator[Tuple[str, List[float]]]:
+    """Лениво прочитать пакеты из строк файла или потока.
+
+    Если передан список dead_letters, строки с нечисловыми значениями
+    откладываются в него, а не прерывают чтение.
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            package = parse_package(line)
+        except ValueError:
+            if dead_letters is None:
+                raise
+            workout_type, *data = line.split()
+            dead_letters.append((workout_type, data,
+                                 'Значения пакета должны быть числами.'))
+            continue
+        yield package
+
+
+class ResultCache:
+    """Кэш сообщений о тренировках в файле SQLite по хэшу пакета."""
+
+    def __init__(self, path: str, max_entries: int = 1_000_000,
+                 commit_every: int = 1000) -> None:
+        import sqlite3
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'key BLOB PRIMARY KEY, training_type TEXT, duration REAL, '
+            'distance REAL, speed REAL, calories REAL)')
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+        self.loaded: Optional[Dict[bytes, InfoMessage]] = None
+        (self.size,) = self.connection.execute(
+            'SELECT COUNT(*) FROM results').fetchone()
+
+    def get(self, workout_type: str, data: list) -> Optional[InfoMessage]:
+        """Найти сообщение для пакета в кэше."""
+        key = package_key(workout_type, data)
+        if self.loaded is not None:
+            info = self.loaded.get(key)
+            if info is None:
+                self.misses += 1
+                return None
+        else:
+            row = self.connection.execute(
+                'SELECT training_type, duration, distance, speed, calories '
+                'FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            info = InfoMessage(*row)
+        self.hits += 1
+        return info
+
+    def load(self) -> int:
+        """Загрузить весь кэш в память для поиска без запросов к диску.
+
+        Дальнейшие записи и вытеснения поддерживают копию в памяти.
+        """
+        self.loaded = {key: InfoMessage(*values)
+                       for key, *values in self.connection.execute(
+                           'SELECT * FROM results')}
+        return len(self.loaded)
+
+    def put_many(self, items: Iterable[Tuple[str, list, InfoMessage]]
+                 ) -> int:
+        """Сохранить сообщения для пакетов и вытеснить старые записи."""
+        rows = [(package_key(workout_type, data), *InfoMessage.values(info))
+                for workout_type, data, info in items]
+        if self.loaded is not None:
+            for key, *values in rows:
+                self.loaded.setdefault(key, InfoMessage(*values))
+        self.size += self.connection.executemany(
+            'INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+            rows).rowcount
+        self.pending += len(rows)
+        if self.size > self.max_entries:
+            self.evict()
+        if self.pending >= self.commit_every:
+            self.commit()
+        return len(rows)
+
+    def evict(self) -> None:
+        """Удалить самые старые записи сверх лимита."""
+        if self.loaded is not None:
+            for (key,) in self.connection.execute(
+                    'SELECT key FROM results ORDER BY rowid LIMIT ?',
+                    (self.size - self.max_entries,)).fetchall():
+                del self.loaded[key]
+        self.size -= self.connection.execute(
+            'DELETE FROM results WHERE rowid IN (SELECT rowid FROM results '
+            'ORDER BY rowid LIMIT ?)',
+            (self.size - self.max_entries,)).rowcount
+
+    def __call__(self, workout_type: str, data: list) -> InfoMessage:
+        """Получить сообщение из кэша или рассчитать и сохранить его."""
+        info = self.get(workout_type, data)
+        if info is None:
+            info = read_package(workout_type, data).show_training_info()
+            self.put_many([(workout_type, data, info)])
+        return info
+
+    def warm_up(self, packages: Iterable[Tuple[str, list]],
+                chunk_size: int = 10_000) -> int:
+        """Рассчитать и сохранить пакеты порциями, вернуть их число."""
+        count = 0
+        for chunk in chunked(packages, chunk_size):
+            count += self.put_many(
+                (workout_type, data,
+                 read_package(workout_type, data).show_training_info())
+                for workout_type, data in chunk)
+        self.commit()
+        return count
+
+    def commit(self) -> None:
+        """Записать накопленные изменения на диск."""
+        self.connection.commit()
+        self.pending = 0
+
+    def close(self) -> None:
+        """Закрыть файл кэша."""
+        self.commit()
+        self.connection.close()
+
+    def __enter__(self) -> 'ResultCache':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class Deduplicator:
+    """Отсев повторных пакетов: фильтр Блума по окнам и точный LRU.
+
+    memory_bytes ограничивает обе структуры: каждая запись точного LRU
+    учитывается как EXACT_ENTRY_BYTES, остаток делят два окна фильтра.
+    Без exact_size на LRU отводится четверть памяти.
+    """
+    EXACT_ENTRY_BYTES: ClassVar = 224
+
+    def __init__(self, memory_bytes: int = 1 << 20, window: float = 10.0,
+                 exact_size: Optional[int] = None, hashes: int = 4,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        if exact_size is None:
+            exact_size = memory_bytes // 4 // self.EXACT_ENTRY_BYTES
+        bloom_bytes = memory_bytes - exact_size * self.EXACT_ENTRY_BYTES
+        if bloom_bytes < 16:
+            raise ValueError('Памяти не хватает на фильтр Блума.')
+        self.size = bloom_bytes // 2 * 8
+        self.hashes = hashes
+        self.window = window
+        self.exact_size = exact_size
+        self.clock = clock
+        self.current = bytearray(self.size // 8)
+        self.previous = bytearray(self.size // 8)
+        self.counts = [0, 0]
+        self.started = clock()
+        self.recent: OrderedDict[bytes, float] = OrderedDict()
+        self.passed = 0
+        self.duplicates = 0
+
+    def rotate(self, now: float) -> None:
+        """Сменить окно фильтра, забыв пакеты старше двух окон."""
+        if now - self.started < self.window:
+            return
+        if now - self.started >= 2 * self.window:
+            self.previous = bytearray(self.size // 8)
+            self.counts[1] = 0
+        else:
+            self.previous = self.current
+            self.counts[1] = self.counts[0]
+        self.current = bytearray(self.size // 8)
+        self.counts[0] = 0
+        self.started = now
+
+    def positions(self, key: bytes) -> List[int]:
+        """Получить номера битов ключа двойным хэшированием."""
+        first = int.from_bytes(key[:8], 'little')
+        second = int.from_bytes(key[8:], 'little') | 1
+        return [(first + index * second) % self.size
+                for index in range(self.hashes)]
+
+    def seen(self, workout_type: str, data: list) -> bool:
+        """Проверить пакет на повтор и запомнить его."""
+        now = self.clock()
+        self.rotate(now)
+        key = package_key(workout_type, data)
+        moment = self.recent.pop(key, None)
+        self.recent[key] = now
+        if len(self.recent) > self.exact_size:
+            self.recent.popitem(last=False)
+        if moment is not None and now - moment < self.window:
+            return True
+        positions = self.positions(key)
+        if any(all(bits[position >> 3] >> (position & 7) & 1
+                   for position in positions)
+               for bits in (self.current, self.previous)):
+            return True
+        for position in positions:
+            self.current[position >> 3] |= 1 << (position & 7)
+        self.counts[0] += 1
+        return False
+
+    def filter(self, packages: Iterable[Tuple[str, list]]
+               ) -> Iterator[Tuple[str, list]]:
+        """Пропустить только первые экземпляры пакетов.
+
+        Пакеты должны быть корректными: для неизвестного типа или неверного
+        числа полей ключ не строится и поднимается ValueError.
+        """
+        for workout_type, data in packages:
+            if self.seen(workout_type, data):
+                self.duplicates += 1
+            else:
+                self.passed += 1
+                yield workout_type, data
+
+    def false_positive_rate(self) -> float:
+        """Оценить долю новых пакетов, ошибочно признанных повтором."""
+        miss = 1.0
+        for count in self.counts:
+            miss *= 1 - (1 - math.exp(-self.hashes * count / self.size)
+                         ) ** self.hashes
+        return 1 - miss
+
+
+def make_info_cache(maxsize: Optional[int] = 65536
+                    ) -> Callable[[str, tuple], InfoMessage]:
+    """Создать общий LRU-кэш сообщений с ключом по содержимому пакета."""
+    @lru_cache(maxsize=maxsize)
+    def cached_info(workout_type: str, data: tuple) -> InfoMessage:
+        return read_package(workout_type, data).show_training_info()
+    return cached_info
+
+
+@dataclass(slots=True, frozen=True)
+class Coefficients:
+    """Неизменяемый снимок коэффициентов расчёта с номером версии."""
+    version: int
+    values: Mapping[str, Mapping[str, float]]
+
+
+@dataclass(slots=True, frozen=True)
+class VersionedInfo:
+    """Сообщение о тренировке с версией использованных коэффициентов."""
+    info: InfoMessage
+    version: int
+
+
+CoefficientValues = Mapping[str, Mapping[str, float]]
+
+
+def class_coefficients(training_class: type) -> Mapping[str, float]:
+    """Собрать коэффициенты класса тренировки: его константы."""
+    return MappingProxyType({name: getattr(training_class, name)
+                             for name in dir(training_class)
+                             if name.isupper()})
+
 
+class CoefficientTable:
+    """Версионная таблица коэффициентов с заменой снимка при записи."""
 
-def main(training: Training) -> None:
+    def __init__(self, values: Optional[CoefficientValues] = None) -> None:
+        import threading
+
+        self.lock = threading.Lock()
+        if values is None:
+            values = {code: class_coefficients(training_class)
+                      for code, training_class in TRAINING_TYPES.items()}
+        self.current = Coefficients(0, MappingProxyType({
+            code: MappingProxyType(dict(items))
+            for code, items in values.items()
+        }))
+        self.classes: Dict[Tuple[int, str, bool], type] = {}
+
+    def snapshot(self) -> Coefficients:
+        """Получить текущий снимок без блокировки."""
+        return self.current
+
+    def export(self) -> Dict[str, Dict[str, float]]:
+        """Получить текущий снимок в виде словарей для других процессов."""
+        return {code: dict(values)
+                for code, values in self.current.values.items()}
+
+    def coefficients(self, snapshot: Coefficients,
+                     workout_type: str) -> Mapping[str, float]:
+        """Получить коэффициенты вида тренировки в снимке.
+
+        Виды, зарегистрированные после создания таблицы, берут
+        коэффициенты из своего класса.
+        """
+        values = snapshot.values.get(workout_type)
+        if values is None:
+            if workout_type not in TRAINING_TYPES:
+                raise ValueError('Неизвестный тип тренировки.')
+            values = class_coefficients(TRAINING_TYPES[workout_type])
+        return values
+
+    def update(self, workout_type: str, **values: float) -> Coefficients:
+        """Опубликовать новый снимок с изменёнными коэффициентами."""
+        with self.lock:
+            current = self.current
+            base = self.coefficients(current, workout_type)
+            unknown = values.keys() - base.keys()
+            if unknown:
+                raise ValueError(f'Неизвестные коэффициенты: {unknown}')
+            table = dict(current.values)
+            table[workout_type] = MappingProxyType({**base, **values})
+            self.current = Coefficients(current.version + 1,
+                                        MappingProxyType(table))
+            self.classes = {}
+            return self.current
+
+    def bind(self, snapshot: Coefficients, workout_type: str,
+             compact: bool = False) -> type:
+        """Получить подкласс тренировки с константами из снимка."""
+        classes = self.classes
+        key = (snapshot.version, workout_type, compact)
+        if key not in classes:
+            base = TRAINING_TYPES[workout_type]
+            if compact:
+                base = compact_type(base)
+            classes[key] = type(base.__name__, (base,), {
+                '__slots__': (),
+                '__module__': base.__module__,
+                '__qualname__': base.__qualname__,
+                **self.coefficients(snapshot, workout_type),
+            })
+        return classes[key]
+
+    def compute(self, workout_type: str, data: list,
+                compact: bool = False) -> VersionedInfo:
+        """Рассчитать пакет по одному согласованному снимку."""
+        snapshot = self.current
+        package_class(workout_type, data)
+        training = self.bind(snapshot, workout_type, compact)(*data)
+        return VersionedInfo(training.show_training_info(), snapshot.version)
+
+
+def stream_info(packages: Iterable[Tuple[str, list]],
+                cache: Optional[Callable[[str, tuple], InfoMessage]] = None,
+                table: Optional[CoefficientTable] = None
+                ) -> Iterator[InfoMessage]:
+    """Лениво обработать поток пакетов, по одному сообщению за раз.
+
+    С таблицей коэффициентов каждый пакет считается по её текущему снимку.
+    """
+    for workout_type, data in packages:
+        if cache is not None:
+            yield cache(workout_type, tuple(data))
+        elif table is not None:
+            yield table.compute(workout_type, data).info
+        else:
+            yield read_package(workout_type, data).show_training_info()
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    """Разбить поток на списки не длиннее size элементов."""
+    if size < 1:
+        raise ValueError('Размер порции должен быть положительным.')
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _process_chunk(chunk: List[Tuple[str, list]],
+                   coefficients: Optional[Dict[str, Dict[str, float]]] = None
+                   ) -> List[InfoMessage]:
+    """Обработать порцию пакетов в дочернем процессе."""
+    table = None if coefficients is None else CoefficientTable(coefficients)
+    return list(stream_info(chunk, table=table))
+
+
+def _pop_done(pending: Deque['Future'], ordered: bool) -> 'Future':
+    """Извлечь следующую завершённую задачу из очереди."""
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    if ordered:
+        return pending.popleft()
+    done = next(iter(wait(pending, return_when=FIRST_COMPLETED).done))
+    pending.remove(done)
+    return done
+
+
+def parallel_info(packages: Iterable[Tuple[str, list]],
+                  workers: Optional[int] = None,
+                  chunk_size: int = 1000,
+                  ordered: bool = True,
+                  table: Optional[CoefficientTable] = None
+                  ) -> Iterator[InfoMessage]:
+    """Обработать поток пакетов в пуле процессов порциями.
+
+    С таблицей коэффициентов порция считается по снимку на момент отправки.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    pending: Deque['Future'] = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk in chunked(packages, chunk_size):
+            coefficients = None if table is None else table.export()
+            pending.append(executor.submit(_process_chunk, chunk,
+                                           coefficients))
+            if len(pending) >= workers * 2:
+                yield from _pop_done(pending, ordered).result()
+        while pending:
+            yield from _pop_done(pending, ordered).result()
+
+
+@dataclass
+class MessageSink:
+    """Приёмник сообщений с буферизацией и пакетной записью."""
+    stream: Optional[TextIO] = None
+    buffer_size: int = 1
+    pending: List[InfoMessage] = field(default_factory=list, repr=False)
+
+    def write(self, info: InfoMessage) -> None:
+        """Добавить сообщение, записав буфер при заполнении."""
+        self.pending.append(info)
+        if len(self.pending) >= self.buffer_size:
+            self.drain()
+
+    def drain(self) -> None:
+        """Записать накопленные сообщения одним вызовом."""
+        if self.pending:
+            (self.stream or sys.stdout).write(format_messages(self.pending))
+            self.pending.clear()
+
+    def flush(self) -> None:
+        """Записать буфер и сбросить поток."""
+        self.drain()
+        (self.stream or sys.stdout).flush()
+
+    def __enter__(self) -> 'MessageSink':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.flush()
+
+
+@dataclass(slots=True, frozen=True)
+class WindowTotals:
+    """Итоги тренировок за скользящее окно."""
+    count: int
+    duration: float
+    distance: float
+    calories: float
+
+    def get_mean_speed(self) -> float:
+        """Получить среднюю скорость за окно."""
+        return self.distance / self.duration if self.duration else 0.0
+
+
+class WindowSeries:
+    """Кольцо корзин с накопленными суммами для одного ключа."""
+    __slots__ = ('buckets', 'totals', 'head')
+    METRICS: ClassVar = 4
+
+    def __init__(self, size: int) -> None:
+        self.buckets = array('d', bytes(8 * self.METRICS * size))
+        self.totals = [0.0] * self.METRICS
+        self.head: Optional[int] = None
+
+    def advance(self, index: int) -> None:
+        """Сдвинуть окно до корзины index, вычтя устаревшие корзины."""
+        size = len(self.buckets) // self.METRICS
+        if self.head is None:
+            self.head = index
+        for current in range(max(self.head + 1, index - size + 1),
+                             index + 1):
+            slot = current % size * self.METRICS
+            for metric in range(self.METRICS):
+                self.totals[metric] -= self.buckets[slot + metric]
+                self.buckets[slot + metric] = 0.0
+        self.head = max(self.head, index)
+
+    def add(self, index: int, values: Tuple[float, ...]) -> None:
+        """Добавить значения в корзину index."""
+        self.advance(index)
+        size = len(self.buckets) // self.METRICS
+        if index <= self.head - size:
+            return
+        slot = index % size * self.METRICS
+        for metric, value in enumerate(values):
+            self.buckets[slot + metric] += value
+            self.totals[metric] += value
+
+
+@dataclass
+class WorkoutAggregator:
+    """Инкрементальные итоги по спортсменам и видам тренировок."""
+    window: float = 3600.0
+    bucket: float = 60.0
+    series: Dict[Tuple[Optional[str], Optional[str]], WindowSeries] = field(
+        default_factory=dict, repr=False)
+
+    def add(self, athlete: str, timestamp: float, info) -> None:
+        """Учесть результат тренировки (InfoMessage или Training)."""
+        if not isinstance(info, InfoMessage):
+            info = info.show_training_info()
+        index = math.floor(timestamp / self.bucket)
+        values = (1.0, info.duration, info.distance, info.calories)
+        size = math.ceil(self.window / self.bucket)
+        for key in ((athlete, info.training_type), (athlete, None),
+                    (None, info.training_type), (None, None)):
+            if key not in self.series:
+                self.series[key] = WindowSeries(size)
+            self.series[key].add(index, values)
+
+    def query(self, timestamp: float, athlete: Optional[str] = None,
+              training_type: Optional[str] = None) -> WindowTotals:
+        """Получить итоги за окно, заканчивающееся в момент timestamp.
+
+        Окно только сдвигается вперёд: timestamp не может быть раньше
+        корзины последнего события или предыдущего запроса.
+        """
+        series = self.series.get((athlete, training_type))
+        if series is None:
+            return WindowTotals(0, 0.0, 0.0, 0.0)
+        index = math.floor(timestamp / self.bucket)
+        if index < series.head:
+            raise ValueError('Запрос раньше конца текущего окна.')
+        series.advance(index)
+        count, duration, distance, calories = series.totals
+        return WindowTotals(round(count), duration, distance, calories)
+
+
+@dataclass
+class StageStats:
+    """Счётчики и гистограмма задержек одного этапа обработки."""
+    BOUNDS: ClassVar = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5,
+                        1e-4, 1e-3, 1e-2, math.inf)
+    count: int = 0
+    total: float = 0.0
+    buckets: List[int] = field(
+        default_factory=lambda: [0] * len(StageStats.BOUNDS))
+
+    def observe(self, seconds: float, count: int = 1) -> None:
+        """Учесть измерение пачки из count одинаковых операций."""
+        self.count += count
+        self.total += seconds
+        self.buckets[bisect_left(self.BOUNDS, seconds / count)] += count
+
+
+class Instrumentation:
+    """Подключаемые замеры этапов: разбор, расчёт и форматирование."""
+    METRIC: ClassVar = 'homework_stage_seconds'
+
+    def __init__(self) -> None:
+        self.stats: Dict[Tuple[str, str], StageStats] = {}
+
+    def record(self, stage: str, training_type: str, seconds: float,
+               count: int = 1) -> None:
+        """Учесть длительность этапа для вида тренировки."""
+        key = (stage, training_type)
+        if key not in self.stats:
+            self.stats[key] = StageStats()
+        self.stats[key].observe(seconds, count)
+
+    @contextmanager
+    def measure(self, stage: str, training_type: str,
+                count: int = 1) -> Iterator[None]:
+        """Замерить блок этапа; count — число операций в пачке."""
+        start = time.perf_counter()
+        yield
+        if count:
+            self.record(stage, training_type, time.perf_counter() - start,
+                        count)
+
+    def enable(self) -> 'Instrumentation':
+        """Включить замеры; выключенные они стоят одной проверки на этап."""
+        global _instrumentation
+        if _instrumentation is not None and _instrumentation is not self:
+            raise RuntimeError('Замеры уже включены другим экземпляром.')
+        _instrumentation = self
+        return self
+
+    def disable(self) -> None:
+        """Выключить замеры этого экземпляра."""
+        global _instrumentation
+        if _instrumentation is self:
+            _instrumentation = None
+
+    def __enter__(self) -> 'Instrumentation':
+        return self.enable()
+
+    def __exit__(self, *args) -> None:
+        self.disable()
+
+    def snapshot(self) -> Dict[str, Dict[str, dict]]:
+        """Получить снимок счётчиков по этапам и видам тренировок."""
+        result: Dict[str, Dict[str, dict]] = {}
+        for (stage, training_type), stats in sorted(self.stats.items()):
+            result.setdefault(stage, {})[training_type] = {
+                'count': stats.count,
+                'total': stats.total,
+                'buckets': dict(zip(map(str, stats.BOUNDS), stats.buckets)),
+            }
+        return result
+
+    def to_json(self) -> str:
+        """Получить снимок в формате JSON."""
+        import json
+
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self) -> str:
+        """Получить снимок в текстовом формате Prometheus."""
+        lines = [f'# TYPE {self.METRIC} histogram']
+        for (stage, training_type), stats in sorted(self.stats.items()):
+            labels = f'stage="{stage}",training_type="{training_type}"'
+            cumulative = 0
+            for bound, count in zip(stats.BOUNDS, stats.buckets):
+                cumulative += count
+                le = '+Inf' if bound == math.inf else repr(bound)
+                lines.append(f'{self.METRIC}_bucket{{{labels},le="{le}"}} '
+                             f'{cumulative}')
+            lines.append(f'{self.METRIC}_sum{{{labels}}} {stats.total!r}')
+            lines.append(f'{self.METRIC}_count{{{labels}}} {stats.count}')
+        return '\n'.join(lines) + '\n'
+
+
+class QuantileSketch:
+    """Потоковый KLL-эскиз квантилей с памятью O(k)."""
+
+    def __init__(self, k: int = 200, seed: Optional[int] = None) -> None:
+        self.k = k
+        self.random = random.Random(seed)
+        self.compactors: List[List[float]] = []
+        self.size = 0
+        self.count = 0
+        self.max_size = 0
+        self.grow()
+
+    def grow(self) -> None:
+        """Добавить уровень уплотнения."""
+        self.compactors.append([])
+        self.max_size = sum(map(self.capacity, range(len(self.compactors))))
+
+    def capacity(self, level: int) -> int:
+        """Получить вместимость уровня."""
+        height = len(self.compactors) - level - 1
+        return math.ceil(self.k * (2 / 3) ** height) + 1
+
+    def update(self, value: float) -> None:
+        """Учесть значение."""
+        self.compactors[0].append(value)
+        self.size += 1
+        self.count += 1
+        if self.size >= self.max_size:
+            self.compress()
+
+    def compress(self) -> None:
+        """Уплотнить первый переполненный уровень вдвое."""
+        for level, items in enumerate(self.compactors):
+            if len(items) >= self.capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.grow()
+                items.sort()
+                kept = items[self.random.getrandbits(1)::2]
+                self.compactors[level + 1].extend(kept)
+                self.size -= len(items) - len(kept)
+                items.clear()
+                return
+
+    def quantile(self, q: float) -> float:
+        """Получить приближённое значение квантиля q из [0, 1]."""
+        if not self.count:
+            raise ValueError('Эскиз пуст.')
+        weighted = sorted((value, 1 << level)
+                          for level, items in enumerate(self.compactors)
+                          for value in items)
+        target = q * sum(weight for _, weight in weighted)
+        total = 0
+        for value, weight in weighted:
+            total += weight
+            if total >= target:
+                return value
+        return weighted[-1][0]
+
+
+@dataclass
+class Leaderboard:
+    """Топ-K и квантили по видам тренировок без полной сортировки."""
+    k: int = 100
+    top_key: str = 'calories'
+    quantile_key: str = 'speed'
+    sketch_size: int = 200
+    top: Dict[str, List[Tuple[float, int, InfoMessage]]] = field(
+        default_factory=dict, repr=False)
+    sketches: Dict[str, QuantileSketch] = field(default_factory=dict,
+                                                repr=False)
+    seen: int = 0
+
+    def add(self, info: InfoMessage) -> None:
+        """Учесть результат тренировки."""
+        self.seen += 1
+        heap = self.top.setdefault(info.training_type, [])
+        item = (getattr(info, self.top_key), self.seen, info)
+        if len(heap) < self.k:
+            heapq.heappush(heap, item)
+        elif item[0] > heap[0][0]:
+            heapq.heapreplace(heap, item)
+        if info.training_type not in self.sketches:
+            self.sketches[info.training_type] = QuantileSketch(
+                self.sketch_size, seed=len(self.sketches))
+        self.sketches[info.training_type].update(
+            getattr(info, self.quantile_key))
+
+    def consume(self, messages: Iterable[InfoMessage]) -> 'Leaderboard':
+        """Учесть поток результатов."""
+        for info in messages:
+            self.add(info)
+        return self
+
+    def get_top(self, training_type: str) -> List[InfoMessage]:
+        """Получить лучшие результаты по убыванию top_key."""
+        return [info for *_, info in sorted(self.top.get(training_type, []),
+                                            key=lambda item: (-item[0],
+                                                              item[1]))]
+
+    def get_quantile(self, training_type: str, q: float) -> float:
+        """Получить квантиль quantile_key для вида тренировки."""
+        if training_type not in self.sketches:
+            raise ValueError('Нет результатов для вида тренировки.')
+        return self.sketches[training_type].quantile(q)
+
+
+async def handle_connection(reader: 'asyncio.StreamReader',
+                            writer: 'asyncio.StreamWriter') -> None:
+    """Отвечать сообщением о тренировке на каждую строку с пакетом."""
+    validator = PackageValidator()
+    try:
+        while line := await reader.readline():
+            if not line.strip():
+                continue
+            try:
+                workout_type, data = parse_package(line.decode())
+                reason = validator.check(workout_type, data)
+                if reason is None:
+                    training = read_package(workout_type, data)
+                    response = training.show_training_info().get_message()
+                else:
+                    response = f'Ошибка: {reason}'
+            except (ValueError, TypeError, ArithmeticError) as error:
+                response = f'Ошибка: {error}'
+            writer.write(response.encode() + b'\n')
+            await writer.drain()
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def serve(host: str = '127.0.0.1', port: int = 0,
+                path: Optional[str] = None) -> 'asyncio.AbstractServer':
+    """Запустить сервер приёма пакетов по TCP или Unix-сокету."""
+    import asyncio
+
+    if path is not None:
+        return await asyncio.start_unix_server(handle_connection, path)
+    return await asyncio.start_server(handle_connection, host, port)
+
+
+def _take_work(own: int, queues: List[Deque[tuple]]) -> Optional[tuple]:
+    """Взять порцию из своей очереди или украсть с конца чужой."""
+    try:
+        return queues[own].popleft()
+    except IndexError:
+        pass
+    for queue in queues:
+        try:
+            return queue.pop()
+        except IndexError:
+            continue
+    return None
+
+
+def _steal_work(own: int, queues: List[Deque[tuple]],
+                results: List[Optional[List[str]]],
+                table: Optional[CoefficientTable] = None) -> None:
+    """Обрабатывать порции, пока они есть хотя бы в одной очереди."""
+    while (work := _take_work(own, queues)) is not None:
+        index, chunk = work
+        results[index] = [info.get_message()
+                          for info in stream_info(chunk, table=table)]
+
+
+def threaded_messages(packages: Iterable[Tuple[str, list]],
+                      threads: Optional[int] = None,
+                      chunk_size: int = 1000,
+                      table: Optional[CoefficientTable] = None
+                      ) -> Iterator[str]:
+    """Обработать пакеты в пуле потоков с перехватом работы.
+
+    Горячий путь не изменяет общее состояние: реестр типов и константы
+    классов только читаются, объекты тренировок и сообщений создаются
+    в каждом потоке заново, а каждая порция пишет в свою ячейку results.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    threads = threads or os.cpu_count() or 1
+    chunks = chunked(packages, chunk_size)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        while window := list(islice(chunks, threads * 8)):
+            queues: List[Deque[tuple]] = [deque() for _ in range(threads)]
+            for index, chunk in enumerate(window):
+                queues[index % threads].append((index, chunk))
+            results: List[Optional[List[str]]] = [None] * len(window)
+            for future in [executor.submit(_steal_work, own, queues, results,
+                                           table)
+                           for own in range(threads)]:
+                future.result()
+            for lines in results:
+                yield from lines
+
+
+RESULT_RECORD = struct.Struct('<B7x4d')
+
+
+def result_types() -> Tuple[str, ...]:
+    """Получить имена видов тренировок в порядке их кодов в записях."""
+    return tuple(training_class.__name__
+                 for training_class in TRAINING_TYPES.values())
+
+
+class ResultView:
+    """Запись результата в общей памяти с интерфейсом InfoMessage."""
+    __slots__ = ('buffer', 'offset', 'types')
+
+    def __init__(self, buffer: memoryview, offset: int,
+                 types: Tuple[str, ...]) -> None:
+        self.buffer = buffer
+        self.offset = offset
+        self.types = types
+
+    def values(self) -> Tuple[str, float, float, float, float]:
+        """Получить поля записи в порядке полей InfoMessage."""
+        code, *values = RESULT_RECORD.unpack_from(self.buffer, self.offset)
+        return (self.types[code], *values)
+
+    training_type = property(lambda self: self.values()[0])
+    duration = property(lambda self: self.values()[1])
+    distance = property(lambda self: self.values()[2])
+    speed = property(lambda self: self.values()[3])
+    calories = property(lambda self: self.values()[4])
+
+    def get_message(self) -> str:
+        """Получить сообщение о тренировке."""
+        values = self.values()
+        if _instrumentation is None:
+            return InfoMessage.template % values
+        with _instrumentation.measure('format', values[0]):
+            return InfoMessage.template % values
+
+    def to_info(self) -> InfoMessage:
+        """Скопировать запись в обычное сообщение."""
+        return InfoMessage(*self.values())
+
+
+class SharedResults:
+    """Буфер записей результатов фиксированной длины в общей памяти."""
+
+    def __init__(self, slots: int, name: Optional[str] = None) -> None:
+        from multiprocessing import shared_memory
+
+        self.memory = shared_memory.SharedMemory(
+            name, create=name is None, size=max(1, slots) * RESULT_RECORD.size)
+        self.owner = name is None
+        self.types = result_types()
+
+    @property
+    def name(self) -> str:
+        """Имя сегмента общей памяти для подключения из других процессов."""
+        return self.memory.name
+
+    def write(self, start: int, messages: Iterable[InfoMessage]) -> int:
+        """Записать сообщения начиная со слота start, вернуть их число."""
+        codes = {name: code for code, name in enumerate(self.types)}
+        count = 0
+        for count, info in enumerate(messages, 1):
+            training_type, *values = InfoMessage.values(info)
+            RESULT_RECORD.pack_into(
+                self.memory.buf, (start + count - 1) * RESULT_RECORD.size,
+                codes[training_type], *values)
+        return count
+
+    def views(self, start: int, count: int) -> Iterator[ResultView]:
+        """Получить представления записей без копирования."""
+        for slot in range(start, start + count):
+            yield ResultView(self.memory.buf, slot * RESULT_RECORD.size,
+                             self.types)
+
+    def close(self) -> None:
+        """Отключиться от памяти; владелец также освобождает её."""
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def __enter__(self) -> 'SharedResults':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def _fill_shared(name: str, start: int,
+                 chunk: List[Tuple[str, list]]) -> Tuple[int, int]:
+    """Рассчитать порцию в дочернем процессе прямо в общую память."""
+    results = SharedResults(0, name)
+    try:
+        return start, results.write(start, stream_info(chunk))
+    finally:
+        results.close()
+
+
+def shared_parallel_info(packages: Iterable[Tuple[str, list]],
+                         workers: Optional[int] = None,
+                         chunk_size: int = 1000) -> Iterator[ResultView]:
+    """Обработать пакеты в пуле процессов с возвратом через общую память.
+
+    Представления указывают на кольцо слотов и действительны, пока
+    генератор не перешёл к следующей порции; для хранения вызовите
+    to_info().
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    regions = workers * 2
+    pending: Deque['Future'] = deque()
+    with SharedResults(regions * chunk_size) as results, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        for number, chunk in enumerate(chunked(packages, chunk_size)):
+            if len(pending) == regions:
+                yield from results.views(*pending.popleft().result())
+            pending.append(executor.submit(
+                _fill_shared, results.name,
+                number % regions * chunk_size, chunk))
+        while pending:
+            yield from results.views(*pending.popleft().result())
+
+
+def main(training: Training, sink: Optional[MessageSink] = None) -> None:
     """Главная функция."""
     info: InfoMessage = training.show_training_info()
-    print(info.get_message())
+    if sink is None:
+        print(info.get_message())
+    else:
+        sink.write(info)
     return None
 
 
-if __name__ == '__main__':
-    packages = [
-        ('SWM', [420, 4, 20, 42, 4]),
-        ('RUN', [15000, 1, 75]),
-        ('WLK', [9000, 1, 75, 180]),
-    ]
+def read_inputs(paths: List[str], binary: bool = False,
+                dead_letters: Optional[List[Tuple[str, list, str]]] = None
+                ) -> Iterator[Tuple[str, list]]:
+    """Лениво прочитать пакеты из файлов; `-` означает stdin."""
+    for path in paths:
+        if binary and path == '-':
+            yield from unpack_packages(sys.stdin.buffer.read())
+        elif binary:
+            yield from read_binary_packages(path)
+        elif path == '-':
+            yield from read_packages(sys.stdin, dead_letters)
+        else:
+            with open(path, encoding='utf-8') as file:
+                yield from read_packages(file, dead_letters)
 
-    for workout_type, data in packages:
-        training = read_package(workout_type, data)
-        main(training)
+
+async def serve_forever(host: str, port: int,
+                        path: Optional[str] = None) -> None:
+    """Обслуживать подключения до остановки процесса."""
+    server = await serve(host, port, path)
+    async with server:
+        await server.serve_forever()
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    """Разобрать аргументы командной строки."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='python -m homework',
+        description='Обработать пакеты данных от фитнес-трекера.')
+    parser.add_argument('paths', nargs='*', default=['-'],
+                        help='файлы с пакетами, по умолчанию stdin')
+    parser.add_argument('--binary', action='store_true',
+                        help='файлы в двоичном формате пакетов')
+    parser.add_argument('--validate', action='store_true',
+                        help='отбраковывать некорректные пакеты в stderr')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='обрабатывать пакеты в пуле процессов')
+    parser.add_argument('--buffer', type=int, default=1024,
+                        help='число сообщений в буфере вывода')
+    parser.add_argument('--serve', metavar='[HOST:]PORT',
+                        help='запустить сервер приёма пакетов по TCP')
+    parser.add_argument('--socket', metavar='PATH',
+                        help='запустить сервер на Unix-сокете')
+    return parser.parse_args(argv)
+
+
+def cli(argv: Optional[List[str]] = None,
+        table: Optional[CoefficientTable] = None) -> int:
+    """Точка входа командной строки."""
+    args = parse_args(argv)
+    if args.serve or args.socket:
+        import asyncio
+
+        host, _, port = (args.serve or '').rpartition(':')
+        asyncio.run(serve_forever(host or '127.0.0.1', int(port or 0),
+                                  args.socket))
+        return 0
+    validator = PackageValidator()
+    if args.validate:
+        packages = validator.validate(read_inputs(
+            args.paths, args.binary, validator.dead_letters))
+    else:
+        packages = read_inputs(args.paths, args.binary)
+    if args.workers:
+        messages = parallel_info(packages, workers=args.workers,
+                                 table=table)
+    else:
+        messages = stream_info(packages, table=table)
+    with MessageSink(buffer_size=args.buffer) as sink:
+        for info in messages:
+            sink.write(info)
+    for workout_type, data, reason in validator.dead_letters:
+        print(workout_type, *data, f'# {reason}', file=sys.stderr)
+    return 1 if validator.dead_letters else 0
+
+
+if __name__ == '__main__':
+    sys.exit(cli())
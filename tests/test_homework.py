@@ -1,9 +1,23 @@
+import asyncio
+import bisect
+import collections
+import io
+import random
 import re
+import subprocess
+import sys
+import threading
 import pytest
 import types
 import inspect
-from collections import namedtuple
-from conftest import Capturing
+import itertools
+import json
+import math
+import pickle
+import tracemalloc
+from collections import deque, namedtuple
+from dataclasses import dataclass
+from conftest import BASE_DIR, Capturing
 
 try:
     import homework
@@ -451,3 +465,1149 @@ def test_main_output(input_data, expected):
     assert get_message_output == expected, (
         'Метод `main` должен печатать результат в консоль.\n'
     )
+
+
+@pytest.mark.parametrize('workout_type, packages', [
+    ('SWM', [[720, 1, 80, 25, 40], [420, 4, 20, 42, 4]]),
+    ('RUN', [[15000, 1, 75], [1206, 12, 6], [420, 4, 20]]),
+    ('WLK', [[9000, 1, 75, 180], [3000.33, 2.512, 75.8, 180.1]]),
+])
+def test_compute_batch(workout_type, packages):
+    np = pytest.importorskip('numpy')
+    training_class = homework.TRAINING_TYPES[workout_type]
+    names = homework.package_fields(training_class)
+    columns = {name: np.array(column) for name, column in zip(names,
+                                                              zip(*packages))}
+    distance, speed, calories = homework.compute_batch(workout_type, columns)
+    for index, data in enumerate(packages):
+        training = homework.read_package(workout_type, data)
+        assert distance[index] == pytest.approx(training.get_distance()), (
+            'Пакетный расчёт дистанции должен совпадать с `get_distance`.'
+        )
+        assert speed[index] == pytest.approx(training.get_mean_speed()), (
+            'Пакетный расчёт скорости должен совпадать с `get_mean_speed`.'
+        )
+        assert calories[index] == pytest.approx(
+            training.get_spent_calories()
+        ), (
+            'Пакетный расчёт калорий должен совпадать '
+            'с `get_spent_calories`.'
+        )
+
+
+def test_compute_batch_unknown_type():
+    pytest.importorskip('numpy')
+    with pytest.raises(ValueError):
+        homework.compute_batch('XXX', {})
+
+
+def test_read_packages():
+    lines = ['SWM 720 1 80 25 40\n', '\n', 'RUN 15000 1 75\n']
+    result = list(homework.read_packages(lines))
+    assert result == [('SWM', [720, 1, 80, 25, 40]),
+                      ('RUN', [15000, 1, 75])], (
+        '`read_packages` должна разбирать строки и пропускать пустые.'
+    )
+
+
+def test_stream_info():
+    packages = [('SWM', [720, 1, 80, 25, 40]), ('WLK', [9000, 1, 75, 180])]
+    stream = homework.stream_info(iter(packages))
+    assert isinstance(stream, types.GeneratorType), (
+        '`stream_info` должна быть генератором.'
+    )
+    expected = [homework.read_package(*package).show_training_info()
+                for package in packages]
+    assert list(stream) == expected
+
+
+@pytest.mark.parametrize('size, expected', [
+    (2, [[0, 1], [2, 3], [4]]),
+    (5, [[0, 1, 2, 3, 4]]),
+])
+def test_chunked(size, expected):
+    assert list(homework.chunked(range(5), size)) == expected
+
+
+def test_stream_info_constant_memory():
+    package = ('RUN', [15000, 1, 75])
+
+    def peak(count):
+        tracemalloc.start()
+        for _ in homework.stream_info(itertools.repeat(package, count)):
+            pass
+        result = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return result
+
+    assert peak(50_000) < peak(2_000) * 2 + 4096, (
+        'Потребление памяти потока не должно зависеть от его длины.'
+    )
+
+
+@pytest.mark.parametrize('input_data', [
+    ('SWM', [720, 1, 80, 25, 40]),
+    ('RUN', [15000, 1, 75]),
+    ('WLK', [9000, 1, 75, 180]),
+])
+def test_read_compact_package(input_data):
+    compact = homework.read_compact_package(*input_data)
+    training = homework.read_package(*input_data)
+    assert type(compact).__name__ == type(training).__name__
+    assert not hasattr(compact, '__dict__'), (
+        'Компактный вариант тренировки должен использовать `__slots__`.'
+    )
+    assert (compact.show_training_info().get_message()
+            == training.show_training_info().get_message())
+    with pytest.raises(AttributeError):
+        compact.duration = 2
+
+
+def test_compact_training_pickle():
+    compact = homework.read_compact_package('RUN', [15000, 1, 75])
+    assert type(compact) is homework.CompactRunning
+    assert repr(compact).startswith('CompactRunning('), (
+        'Компактный вариант должен отличаться от обычного класса по repr.'
+    )
+    assert pickle.loads(pickle.dumps(compact)) == compact, (
+        'Компактные тренировки должны передаваться между процессами.'
+    )
+    with pytest.raises(AttributeError):
+        homework.CompactCycling
+
+
+@pytest.mark.parametrize('input_data', [
+    ('RUN', [15000, 1]),
+    ('XXX', [1, 2, 3]),
+])
+def test_read_compact_package_wrong_input(input_data):
+    with pytest.raises(ValueError):
+        homework.read_compact_package(*input_data)
+
+
+def test_compact_training_memory():
+    data = [15000, 1, 75]
+
+    def allocated(factory):
+        tracemalloc.start()
+        objects = [factory(*data) for _ in range(10_000)]
+        result = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del objects
+        return result
+
+    regular = allocated(homework.Running)
+    compact = allocated(homework.compact_type(homework.Running))
+    assert compact < regular * 0.75, (
+        'Компактный вариант должен занимать заметно меньше памяти: '
+        f'{compact} против {regular} байт.'
+    )
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_parallel_info(ordered):
+    packages = [
+        ('SWM', [720, 1, 80, 25, 40]),
+        ('RUN', [1206, 12, 6]),
+        ('WLK', [9000, 1.5, 75, 180]),
+    ] * 7
+    expected = list(homework.stream_info(packages))
+    result = list(homework.parallel_info(iter(packages), workers=2,
+                                         chunk_size=4, ordered=ordered))
+    if ordered:
+        assert result == expected, (
+            '`parallel_info` должна сохранять порядок входного потока.'
+        )
+    else:
+        assert sorted(result, key=repr) == sorted(expected, key=repr)
+
+
+PACKAGES = [
+    ('SWM', [720, 1, 80, 25, 40]),
+    ('RUN', [1206, 12, 6]),
+    ('WLK', [3000.33, 2.512, 75.8, 180.1]),
+    ('RUN', [15000, 1, 75]),
+]
+
+
+def test_binary_packages_round_trip(tmp_path):
+    path = tmp_path / 'packages.bin'
+    assert homework.write_binary_packages(path, PACKAGES) == len(PACKAGES)
+    assert list(homework.read_binary_packages(path)) == PACKAGES, (
+        'Пакеты должны читаться из двоичного файла без изменений.'
+    )
+
+
+def test_binary_packages_bad_magic(tmp_path):
+    path = tmp_path / 'packages.bin'
+    path.write_bytes(b'not a package file')
+    with pytest.raises(ValueError):
+        list(homework.read_binary_packages(path))
+
+
+@pytest.mark.parametrize('input_data', [
+    ('WLK', [9000, 1, 75]),
+    ('RUN', [15000, 1, 75, 180]),
+    ('XXX', [1, 2, 3]),
+])
+def test_binary_packages_rejects_bad_package(tmp_path, input_data):
+    with pytest.raises(ValueError):
+        homework.write_binary_packages(tmp_path / 'packages.bin',
+                                       [input_data])
+
+
+def test_binary_packages_unknown_code(tmp_path):
+    path = tmp_path / 'packages.bin'
+    homework.write_binary_packages(path, PACKAGES)
+    content = path.read_bytes().replace(b'RUN', b'XXX')
+    path.write_bytes(content)
+    with pytest.raises(ValueError):
+        list(homework.read_binary_packages(path))
+
+
+def test_binary_packages_truncated(tmp_path):
+    path = tmp_path / 'packages.bin'
+    homework.write_binary_packages(path, PACKAGES)
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(ValueError):
+        list(homework.read_binary_packages(path))
+
+
+def test_memmap_binary_packages(tmp_path):
+    pytest.importorskip('numpy')
+    path = tmp_path / 'packages.bin'
+    homework.write_binary_packages(path, PACKAGES)
+    records = homework.memmap_binary_packages(path)
+    columns = homework.binary_columns(records, 'RUN')
+    distance, _, calories = homework.compute_batch('RUN', columns)
+    expected = [homework.read_package(*package)
+                for package in PACKAGES if package[0] == 'RUN']
+    assert list(distance) == [training.get_distance()
+                              for training in expected]
+    assert list(calories) == [training.get_spent_calories()
+                              for training in expected]
+
+
+@pytest.mark.parametrize('values', [
+    ('Swimming', 1, 75, 1, 80),
+    ('Running', 0.0004, -2.5, 1e12, float('nan')),
+    ('SportsWalking', 2.512, 1.950165, 0.7763, 408.4287),
+])
+def test_InfoMessage_template_matches_format(values):
+    info_message = homework.InfoMessage(*values)
+    expected = homework.InfoMessage.info.format(
+        **dict(zip(homework.InfoMessage.names, values))
+    )
+    assert info_message.get_message() == expected, (
+        'Быстрый шаблон должен совпадать с `str.format` побайтно.'
+    )
+
+
+def test_format_messages():
+    messages = list(homework.stream_info(PACKAGES))
+    expected = ''.join(message.get_message() + '\n' for message in messages)
+    assert homework.format_messages(messages) == expected
+    assert homework.format_messages([]) == ''
+
+
+@pytest.mark.parametrize('buffer_size', [1, 3, 100])
+def test_MessageSink(buffer_size):
+    stream = io.StringIO()
+    with homework.MessageSink(stream, buffer_size) as sink:
+        for package in PACKAGES:
+            homework.main(homework.read_package(*package), sink)
+            assert len(sink.pending) < buffer_size, (
+                'Приёмник должен записывать буфер при его заполнении.'
+            )
+    with Capturing() as expected:
+        for package in PACKAGES:
+            homework.main(homework.read_package(*package))
+    assert stream.getvalue().splitlines() == expected
+
+
+def test_MessageSink_stdout():
+    with Capturing() as output:
+        with homework.MessageSink(buffer_size=10) as sink:
+            homework.main(homework.read_package(*PACKAGES[0]), sink)
+            assert sys.stdout.getvalue() == '', (
+                'Приёмник не должен писать до заполнения буфера.'
+            )
+    assert output == [
+        homework.read_package(*PACKAGES[0]).show_training_info().get_message()
+    ]
+
+
+def test_serve():
+    async def client(port, lines):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(''.join(lines).encode())
+        await writer.drain()
+        writer.write_eof()
+        result = [line.decode().rstrip('\n')
+                  async for line in reader]
+        writer.close()
+        return result
+
+    async def scenario():
+        server = await homework.serve()
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await asyncio.gather(*(
+                client(port, ['RUN 15000 1 75\n', 'XXX 1 2 3\n',
+                              'RUN 15000 0 75\n', 'RUN 15000 abc 75\n',
+                              'WLK 1e300 1 75 180\n',
+                              'WLK 9000 1 75 180\n'])
+                for _ in range(50)
+            ))
+
+    expected = [
+        homework.read_package('RUN', [15000, 1, 75])
+        .show_training_info().get_message(),
+        'Ошибка: Неизвестный тип тренировки.',
+        'Ошибка: Поле duration вне допустимого диапазона.',
+        "Ошибка: could not convert string to float: 'abc'",
+        None,
+        homework.read_package('WLK', [9000, 1, 75, 180])
+        .show_training_info().get_message(),
+    ]
+    for result in asyncio.run(scenario()):
+        assert len(result) == len(expected), (
+            'Сервер должен отвечать сообщением на каждый пакет.'
+        )
+        for line, message in zip(result, expected):
+            if message is None:
+                assert line.startswith('Ошибка: ')
+            else:
+                assert line == message
+
+
+def test_Training_plain_instance_state():
+    running = homework.Running(15000, 1, 75)
+    assert vars(running) == {'action': 15000, 'duration': 1, 'weight': 75}, (
+        'Экземпляр тренировки должен хранить только поля пакета.'
+    )
+    running.duration = 2
+    assert running.get_mean_speed() == running.get_distance() / 2, (
+        'Метрики должны пересчитываться по текущим полям.'
+    )
+
+
+def test_compact_training_metrics():
+    compact = homework.read_compact_package('SWM', [720, 1, 80, 25, 40])
+    assert compact._get_mean_speed is None
+    assert compact.get_mean_speed() == compact.get_mean_speed() == 1.0
+    assert compact._get_mean_speed == 1.0, (
+        'Скорость неизменяемой тренировки должна кэшироваться в слоте.'
+    )
+    assert pickle.loads(pickle.dumps(compact)) == compact
+    assert compact == homework.read_compact_package('SWM',
+                                                    [720, 1, 80, 25, 40])
+
+
+def test_make_info_cache():
+    cache = homework.make_info_cache(maxsize=2)
+    packages = [PACKAGES[0], PACKAGES[0], PACKAGES[1], PACKAGES[2],
+                PACKAGES[0]]
+    result = list(homework.stream_info(packages, cache))
+    assert result == list(homework.stream_info(packages))
+    info = cache.cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 4, 2), (
+        'Кэш должен считать попадания и вытеснять старые пакеты.'
+    )
+
+
+def test_register_training(monkeypatch):
+    monkeypatch.setattr(homework, 'TRAINING_TYPES',
+                        dict(homework.TRAINING_TYPES))
+    monkeypatch.setattr(homework, '_TRAINING_ARITY',
+                        dict(homework._TRAINING_ARITY))
+
+    @homework.register_training('CYC')
+    @dataclass
+    class Cycling(homework.Training):
+        LEN_STEP = 5.5
+
+    training = homework.read_package('CYC', [1000, 2, 70])
+    assert isinstance(training, Cycling), (
+        '`read_package` должна находить зарегистрированные тренировки.'
+    )
+    assert training.get_mean_speed() == 2.75
+    assert training == Cycling(1000, 2, 70)
+
+
+def test_register_training_defaults_and_post_init(monkeypatch):
+    monkeypatch.setattr(homework, 'TRAINING_TYPES',
+                        dict(homework.TRAINING_TYPES))
+    monkeypatch.setattr(homework, '_TRAINING_ARITY',
+                        dict(homework._TRAINING_ARITY))
+
+    @homework.register_training('HIK')
+    @dataclass
+    class Hiking(homework.Training):
+        elevation: float = 0.0
+
+        def __post_init__(self):
+            self.checked = True
+
+    training = homework.read_package('HIK', [1000, 1, 70])
+    assert training == Hiking(1000, 1, 70), (
+        'Поля со значением по умолчанию можно не передавать в пакете.'
+    )
+    assert training.checked, '`read_package` должна вызывать __post_init__.'
+    assert homework.read_package('HIK', [1000, 1, 70, 50]).elevation == 50
+    with pytest.raises(ValueError):
+        homework.read_package('HIK', [1000, 1])
+    with pytest.raises(ValueError):
+        homework.read_package('HIK', [1000, 1, 70, 50, 1])
+
+
+@pytest.mark.parametrize('code', ['CYCLE', 'CY', 'ВЕЛ'])
+def test_register_training_rejects_bad_code(code):
+    with pytest.raises(ValueError):
+        homework.register_training(code)
+
+
+def test_register_training_rejects_wide_package(monkeypatch):
+    monkeypatch.setattr(homework, 'TRAINING_TYPES',
+                        dict(homework.TRAINING_TYPES))
+
+    @dataclass
+    class Triathlon(homework.Training):
+        swim: float = 0.0
+        bike: float = 0.0
+        run: float = 0.0
+
+    with pytest.raises(ValueError):
+        homework.register_training('TRI')(Triathlon)
+    assert 'TRI' not in homework.TRAINING_TYPES
+
+
+def test_pack_package_fills_defaults(monkeypatch, tmp_path):
+    monkeypatch.setattr(homework, 'TRAINING_TYPES',
+                        dict(homework.TRAINING_TYPES))
+    monkeypatch.setattr(homework, '_TRAINING_ARITY',
+                        dict(homework._TRAINING_ARITY))
+
+    @homework.register_training('HIK')
+    @dataclass
+    class Hiking(homework.Training):
+        elevation: float = 10.0
+
+    assert (homework.package_key('HIK', [1000, 1, 70])
+            == homework.package_key('HIK', [1000, 1, 70, 10.0])), (
+        'Опущенные поля должны заполняться значениями по умолчанию.'
+    )
+    assert not homework.Deduplicator().seen('HIK', [1000, 1, 70])
+    path = tmp_path / 'packages.bin'
+    homework.write_binary_packages(path, [('HIK', [1000, 1, 70])])
+    assert list(homework.read_binary_packages(path)) == [
+        ('HIK', [1000, 1, 70, 10.0])]
+
+
+@pytest.mark.parametrize('input_data', [
+    ('RUN', [15000, 1]),
+    ('SWM', [720, 1, 80, 25, 40, 1]),
+])
+def test_read_package_wrong_arity(input_data):
+    with pytest.raises(ValueError):
+        homework.read_package(*input_data)
+
+
+def test_WorkoutAggregator_matches_naive():
+    rng = random.Random(11)
+    aggregator = homework.WorkoutAggregator(window=600, bucket=30)
+    events = []
+    timestamp = 0.0
+    for _ in range(2000):
+        timestamp += rng.expovariate(1 / 7)
+        athlete = rng.choice(['anna', 'boris', 'vera'])
+        info = homework.read_package(*rng.choice(PACKAGES))
+        if rng.random() < 0.5:
+            info = info.show_training_info()
+        aggregator.add(athlete, timestamp, info)
+        events.append((athlete, timestamp, info))
+        if rng.random() < 0.05:
+            now = timestamp + rng.choice([0, 100, 1000])
+            first = (now // 30 - 19) * 30
+            for athlete, training_type in [(athlete, None),
+                                           (None, 'Running'),
+                                           (athlete, 'Swimming'),
+                                           (None, None)]:
+                selected = [
+                    info if isinstance(info, homework.InfoMessage)
+                    else info.show_training_info()
+                    for event_athlete, moment, info in events
+                    if moment >= first
+                    and athlete in (None, event_athlete)
+                ]
+                selected = [info for info in selected
+                            if training_type in (None, info.training_type)]
+                result = aggregator.query(now, athlete, training_type)
+                assert result.count == len(selected), (
+                    'Число тренировок в окне должно совпадать '
+                    'с наивным пересчётом.'
+                )
+                for name in ('duration', 'distance', 'calories'):
+                    assert getattr(result, name) == pytest.approx(
+                        sum(getattr(info, name) for info in selected),
+                        abs=1e-6
+                    )
+            timestamp = now
+
+
+def test_WorkoutAggregator_rejects_past_query():
+    aggregator = homework.WorkoutAggregator(window=600, bucket=30)
+    info = homework.read_package(*PACKAGES[1]).show_training_info()
+    for timestamp in (0, 3000, 3001):
+        aggregator.add('anna', timestamp, info)
+    assert aggregator.query(3001).count == 2
+    with pytest.raises(ValueError):
+        aggregator.query(100)
+    assert aggregator.query(3700).count == 0, (
+        'Запросы в будущее должны сдвигать окно.'
+    )
+    with pytest.raises(ValueError):
+        aggregator.query(3001)
+
+
+def test_Instrumentation():
+    read_package = homework.read_package
+    get_message = homework.InfoMessage.get_message
+    with homework.Instrumentation() as instrumentation:
+        for info in homework.stream_info(PACKAGES):
+            info.get_message()
+    assert homework.read_package is read_package, (
+        'После выключения замеров функции должны быть восстановлены.'
+    )
+    assert homework.InfoMessage.get_message is get_message
+    assert not hasattr(homework.Running.get_spent_calories, '__wrapped__')
+    snapshot = instrumentation.snapshot()
+    assert snapshot['parse'] == {
+        name: snapshot['parse'][name] for name in
+        ('Running', 'SportsWalking', 'Swimming')
+    }
+    assert snapshot['parse']['Running']['count'] == 2
+    assert snapshot['compute']['Swimming']['count'] == 1
+    assert sum(snapshot['format']['Running']['buckets'].values()) == 2
+    assert json.loads(instrumentation.to_json()) == snapshot
+    prometheus = instrumentation.to_prometheus()
+    assert ('homework_stage_seconds_count{stage="format",'
+            'training_type="SportsWalking"} 1') in prometheus
+    assert ('homework_stage_seconds_bucket{stage="compute",'
+            'training_type="Running",le="+Inf"} 2') in prometheus
+
+
+def test_Instrumentation_sink_format():
+    format_messages = homework.format_messages
+    stream = io.StringIO()
+    with homework.Instrumentation() as instrumentation:
+        with homework.MessageSink(stream, buffer_size=2) as sink:
+            for package in PACKAGES:
+                homework.main(homework.read_package(*package), sink)
+    assert homework.format_messages is format_messages
+    snapshot = instrumentation.snapshot()
+    assert sorted(snapshot) == ['compute', 'format', 'parse'], (
+        'Форматирование через приёмник должно попадать в замеры.'
+    )
+    assert snapshot['format']['batch']['count'] == len(PACKAGES)
+    assert sum(snapshot['format']['batch']['buckets'].values()) == len(
+        PACKAGES)
+
+
+def test_Instrumentation_registered_subclass(monkeypatch):
+    monkeypatch.setattr(homework, 'TRAINING_TYPES',
+                        dict(homework.TRAINING_TYPES))
+    monkeypatch.setattr(homework, '_TRAINING_ARITY',
+                        dict(homework._TRAINING_ARITY))
+
+    @homework.register_training('TRL')
+    @dataclass
+    class Trail(homework.Running):
+        pass
+
+    with homework.Instrumentation() as instrumentation:
+        homework.read_package('TRL', [15000, 1, 75]).show_training_info()
+    snapshot = instrumentation.snapshot()
+    assert snapshot['compute']['Trail']['count'] == 1, (
+        'Вызов подкласса должен учитываться один раз.'
+    )
+
+
+def test_Instrumentation_single_active():
+    read_package = homework.read_package
+    first = homework.Instrumentation().enable()
+    second = homework.Instrumentation()
+    with pytest.raises(RuntimeError):
+        second.enable()
+    second.disable()
+    first.disable()
+    assert homework.read_package is read_package
+    assert homework._instrumentation is None
+
+
+def test_Instrumentation_compact_after_disable():
+    with homework.Instrumentation() as instrumentation:
+        homework.compact_type.cache_clear()
+        homework.read_compact_package(*PACKAGES[0]).show_training_info()
+    recorded = instrumentation.snapshot()
+    homework.read_compact_package(*PACKAGES[0]).show_training_info()
+    assert instrumentation.snapshot() == recorded, (
+        'После выключения замеров компактные классы не должны их вести.'
+    )
+
+
+BAD_PACKAGES = [
+    ('XXX', [1, 2, 3]),
+    ('RUN', [15000, 1]),
+    ('RUN', [15000, 0, 75]),
+    ('WLK', [9000, 1, 75, 0]),
+    ('SWM', [720, 1, 80, 25, -1]),
+    ('RUN', [15000, 1, '75']),
+    ('RUN', [15000, float('nan'), 75]),
+    ('RUN', [True, 1, 75]),
+]
+
+
+def test_PackageValidator():
+    validator = homework.PackageValidator()
+    packages = [item for pair in zip(PACKAGES, BAD_PACKAGES) for item in pair]
+    packages += BAD_PACKAGES[len(PACKAGES):]
+    valid = list(homework.stream_info(validator.validate(packages)))
+    assert valid == list(homework.stream_info(PACKAGES)), (
+        'Корректные пакеты должны пройти проверку без изменений.'
+    )
+    assert [(workout_type, data) for workout_type, data, _
+            in validator.dead_letters] == BAD_PACKAGES, (
+        'Некорректные пакеты должны попадать в список отбракованных.'
+    )
+    assert all(reason for *_, reason in validator.dead_letters)
+
+
+def test_PackageValidator_reject_mask():
+    np = pytest.importorskip('numpy')
+    validator = homework.PackageValidator()
+    packages = [[15000, 1, 75], [15000, 0, 75], [-1, 1, 75],
+                [15000, 1, float('inf')], [1206, 12, 6]]
+    columns = dict(zip(homework.package_fields(homework.Running),
+                       np.array(packages).T))
+    mask = validator.reject_mask('RUN', columns)
+    assert list(mask) == [validator.check('RUN', data) is not None
+                          for data in packages]
+    assert list(mask) == [False, True, True, True, False]
+
+
+STARTUP_BUDGET_US = 150_000
+LAZY_MODULES = ('numpy', 'asyncio', 'concurrent.futures', 'multiprocessing',
+                'json', 'argparse', 'sqlite3', 'pyarrow')
+
+
+def test_import_time_budget():
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import homework'],
+        cwd=BASE_DIR, capture_output=True, text=True, check=True
+    )
+    timings = {}
+    for line in result.stderr.splitlines():
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit():
+            timings[name.strip()] = int(cumulative)
+    for module in LAZY_MODULES:
+        assert module not in timings, (
+            f'Модуль `{module}` должен импортироваться лениво.'
+        )
+    assert timings['homework'] < STARTUP_BUDGET_US, (
+        f'Импорт `homework` занял {timings["homework"]} мкс.'
+    )
+
+
+def test_cli(tmp_path):
+    text = tmp_path / 'packages.txt'
+    text.write_text('SWM 720 1 80 25 40\nRUN 15000 0 75\n'
+                    'RUN 15000 abc 75\n\nRUN 1206 12 6\n')
+    binary = tmp_path / 'packages.bin'
+    homework.write_binary_packages(binary, PACKAGES)
+    expected = [homework.read_package(*package)
+                .show_training_info().get_message()
+                for package in [PACKAGES[0], PACKAGES[1]]]
+    with Capturing() as output:
+        assert homework.cli([str(text), '--validate', '--buffer', '1']) == 1
+    assert output == expected
+    with Capturing() as output:
+        assert homework.cli([str(binary), '--binary']) == 0
+    assert output == [info.get_message()
+                      for info in homework.stream_info(PACKAGES)]
+
+
+def test_cli_module_binary_stdin(tmp_path):
+    path = tmp_path / 'packages.bin'
+    homework.write_binary_packages(path, PACKAGES)
+    result = subprocess.run(
+        [sys.executable, '-m', 'homework', '--binary'], cwd=BASE_DIR,
+        input=path.read_bytes(), capture_output=True, check=True
+    )
+    assert result.stdout.decode().splitlines() == [
+        info.get_message() for info in homework.stream_info(PACKAGES)
+    ], 'Двоичные пакеты должны читаться из stdin.'
+
+
+def test_cli_validate_unparsable_line():
+    result = subprocess.run(
+        [sys.executable, '-m', 'homework', '--validate'], cwd=BASE_DIR,
+        input='RUN 15000 abc 75\nRUN 15000 1 75\n', capture_output=True,
+        text=True
+    )
+    assert result.returncode == 1
+    assert len(result.stdout.splitlines()) == 1
+    assert result.stderr == (
+        'RUN 15000 abc 75 # Значения пакета должны быть числами.\n'
+    ), 'Нечисловые строки должны попадать в список отбракованных.'
+
+
+def test_cli_module_stdin():
+    result = subprocess.run(
+        [sys.executable, '-m', 'homework'], cwd=BASE_DIR,
+        input='WLK 9000 1 75 180\n', capture_output=True, text=True,
+        check=True
+    )
+    assert result.stdout.splitlines() == [
+        'Тип тренировки: SportsWalking; '
+        'Длительность: 1.000 ч.; '
+        'Дистанция: 5.850 км; '
+        'Ср. скорость: 5.850 км/ч; '
+        'Потрачено ккал: 349.252.'
+    ]
+
+
+def test_ResultCache(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    expected = list(homework.stream_info(PACKAGES))
+    with homework.ResultCache(path) as cache:
+        assert cache.warm_up(PACKAGES + PACKAGES[:2]) == len(PACKAGES) + 2
+        assert cache.size == len(PACKAGES), (
+            'Одинаковые пакеты должны храниться один раз.'
+        )
+    with homework.ResultCache(path) as cache:
+        replay = PACKAGES + [('RUN', [1206.0, 12.0, 6.0])]
+        assert list(homework.stream_info(replay, cache)) == (
+            expected + [expected[1]]
+        ), 'Кэш должен возвращать сохранённые сообщения.'
+        assert (cache.hits, cache.misses) == (5, 0)
+        assert cache.get('WLK', [1, 1, 1, 1]) is None
+        assert cache.misses == 1
+        assert cache.load() == len(PACKAGES)
+        assert cache.get(*PACKAGES[0]) == expected[0]
+
+
+def test_ResultCache_eviction(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    with homework.ResultCache(path, max_entries=10) as cache:
+        packages = [('RUN', [action, 1, 75]) for action in range(25)]
+        cache.warm_up(packages, chunk_size=4)
+        assert cache.size == 10, 'Размер кэша должен быть ограничен.'
+        assert cache.get(*packages[0]) is None
+        assert cache.get(*packages[-1]) == homework.read_package(
+            *packages[-1]).show_training_info()
+
+
+def test_ResultCache_loaded_stays_in_sync(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    packages = [('RUN', [action, 1, 75]) for action in range(1, 4)]
+    with homework.ResultCache(path, max_entries=2) as cache:
+        cache.warm_up(packages[:2])
+        assert cache.load() == 2
+        cache(*packages[2])
+        assert cache.get(*packages[0]) is None, (
+            'Вытесненные записи не должны находиться после load().'
+        )
+        assert cache.get(*packages[2]) == homework.read_package(
+            *packages[2]).show_training_info(), (
+            'Новые записи должны попадать в загруженный кэш.'
+        )
+        assert len(cache.loaded) == cache.size == 2
+
+
+def test_CoefficientTable():
+    table = homework.CoefficientTable()
+    assert table.snapshot().values['SWM']['LEN_STEP'] == 1.38
+    assert table.snapshot().values['RUN']['M_IN_KM'] == 1000
+    result = table.compute('RUN', [15000, 1, 75])
+    assert result == homework.VersionedInfo(
+        homework.read_package('RUN', [15000, 1, 75]).show_training_info(), 0
+    )
+    snapshot = table.update('RUN', LEN_STEP=0.7)
+    assert snapshot.version == 1
+    assert table.compute('RUN', [1000, 1, 75]).info.distance == 0.7
+    assert homework.Running.LEN_STEP == 0.65, (
+        'Обновление таблицы не должно менять константы классов.'
+    )
+    with pytest.raises(ValueError):
+        table.update('RUN', HEIGHT_M=1)
+    with pytest.raises(TypeError):
+        snapshot.values['RUN']['LEN_STEP'] = 1
+
+
+def test_CoefficientTable_late_registration_and_compact(monkeypatch):
+    monkeypatch.setattr(homework, 'TRAINING_TYPES',
+                        dict(homework.TRAINING_TYPES))
+    monkeypatch.setattr(homework, '_TRAINING_ARITY',
+                        dict(homework._TRAINING_ARITY))
+    table = homework.CoefficientTable()
+
+    @homework.register_training('CYC')
+    @dataclass
+    class Cycling(homework.Training):
+        LEN_STEP = 5.5
+
+    assert table.compute('CYC', [1000, 2, 70]).info.distance == 5.5, (
+        'Таблица должна считать виды, зарегистрированные позже неё.'
+    )
+    table.update('CYC', LEN_STEP=6.0)
+    assert table.compute('CYC', [1000, 2, 70]).info.distance == 6.0
+    with pytest.raises(ValueError):
+        table.compute('XXX', [1, 2, 3])
+    table.update('RUN', LEN_STEP=0.7)
+    result = table.compute('RUN', [1000, 1, 75], compact=True)
+    assert result.info == table.compute('RUN', [1000, 1, 75]).info
+    assert result.info.distance == 0.7, (
+        'Коэффициенты должны применяться и к компактным вариантам.'
+    )
+
+
+def test_CoefficientTable_drivers(tmp_path):
+    table = homework.CoefficientTable()
+    table.update('RUN', LEN_STEP=0.7)
+    packages = [('RUN', [1000, 1, 75])] * 3
+    expected = [table.compute(*package).info for package in packages]
+    assert expected[0].distance == 0.7
+    assert list(homework.stream_info(packages, table=table)) == expected
+    assert list(homework.parallel_info(packages, workers=2, chunk_size=2,
+                                       table=table)) == expected
+    assert list(homework.threaded_messages(packages, threads=2,
+                                           chunk_size=1, table=table)) == [
+        info.get_message() for info in expected]
+    path = tmp_path / 'packages.txt'
+    path.write_text('RUN 1000 1 75\n')
+    with Capturing() as output:
+        assert homework.cli([str(path)], table=table) == 0
+    assert output == [expected[0].get_message()]
+
+
+def test_CoefficientTable_concurrent_swap():
+    table = homework.CoefficientTable()
+    snapshots = [table.snapshot()]
+    results = []
+    stop = threading.Event()
+
+    def worker():
+        local = []
+        while not stop.is_set():
+            local.append(table.compute('RUN', [1000, 1, 75]))
+        results.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for step in range(200):
+        snapshots.append(table.update('RUN', LEN_STEP=0.5 + step / 1000))
+    stop.set()
+    for thread in threads:
+        thread.join()
+    steps = {snapshot.version: snapshot.values['RUN']['LEN_STEP']
+             for snapshot in snapshots}
+    assert results
+    for result in results:
+        assert result.info.distance == 1000 * steps[result.version] / 1000, (
+            'Каждый результат должен соответствовать своей версии '
+            'коэффициентов.'
+        )
+
+
+def test_columnar_round_trip(tmp_path):
+    path = tmp_path / 'results.col'
+    messages = list(homework.stream_info(PACKAGES * 5))
+    assert homework.write_columnar(path, messages, row_group_size=6) == 20
+    groups = list(homework.read_columnar(path))
+    assert [len(group['duration']) for group in groups] == [6, 6, 6, 2], (
+        'Результаты должны записываться группами строк.'
+    )
+    restored = [
+        homework.InfoMessage(*row) for group in groups
+        for row in zip(*(group[name] for name in homework.InfoMessage.names))
+    ]
+    assert restored == messages
+
+
+def test_write_parquet(tmp_path):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    path = tmp_path / 'results.parquet'
+    messages = list(homework.stream_info(PACKAGES * 5))
+    assert homework.write_parquet(path, messages, row_group_size=8) == 20
+    assert parquet.ParquetFile(path).num_row_groups == 3
+    table = parquet.read_table(path).to_pydict()
+    restored = [homework.InfoMessage(*row) for row in zip(
+        *(table[name] for name in homework.InfoMessage.names))]
+    assert restored == messages
+
+
+@pytest.mark.parametrize('input_data, counters, params', [
+    (('RUN', [15000, 1, 75]), {'action': 15000}, {'weight': 75}),
+    (('WLK', [9000, 1.5, 75, 180]), {'action': 9000},
+     {'weight': 75, 'height': 180}),
+    (('SWM', [720, 1, 80, 25, 40]), {'action': 720, 'count_pool': 40},
+     {'weight': 80, 'length_pool': 25}),
+])
+@pytest.mark.parametrize('segment_seconds', [None, 60])
+def test_TraceTraining_constant_pace(input_data, counters, params,
+                                     segment_seconds):
+    np = pytest.importorskip('numpy')
+    duration = input_data[1][1]
+    timestamps = np.arange(int(duration * 36000) + 1) / 10
+    trace = homework.TraceTraining(
+        input_data[0], timestamps,
+        {name: np.linspace(0, total, len(timestamps))
+         for name, total in counters.items()},
+        params, segment_seconds
+    )
+    expected = homework.read_package(*input_data).show_training_info()
+    result = trace.show_training_info()
+    assert result.training_type == expected.training_type
+    for name in ('duration', 'distance', 'speed', 'calories'):
+        assert getattr(result, name) == pytest.approx(
+            getattr(expected, name)
+        ), (
+            'При постоянном темпе запись должна совпадать '
+            'с агрегированным пакетом.'
+        )
+
+
+def test_TraceTraining_segments():
+    np = pytest.importorskip('numpy')
+    timestamps = np.array([0, 1800, 3600, 5400])
+    steps = np.array([0, 3000, 9000, 9000])
+    trace = homework.TraceTraining('RUN', timestamps, {'action': steps},
+                                   {'weight': 75})
+    parts = [homework.Running(3000, 0.5, 75), homework.Running(6000, 0.5, 75),
+             homework.Running(0, 0.5, 75)]
+    assert list(trace.get_speed_profile()) == [
+        part.get_mean_speed() for part in parts
+    ]
+    info = trace.show_training_info()
+    assert info.calories == pytest.approx(
+        sum(part.get_spent_calories() for part in parts)
+    )
+    assert info.speed == pytest.approx(9000 * 0.65 / 1000 / 1.5)
+    with pytest.raises(ValueError):
+        homework.TraceTraining('RUN', timestamps[::-1], {'action': steps},
+                               {'weight': 75}).show_training_info()
+    with pytest.raises(ValueError):
+        homework.TraceTraining('WLK', timestamps, {'action': steps},
+                               {'weight': 75}).show_training_info()
+
+
+def test_Deduplicator():
+    now = [0.0]
+    deduplicator = homework.Deduplicator(window=5, clock=lambda: now[0])
+    stream = [PACKAGES[0], PACKAGES[1], PACKAGES[0], ('RUN', [1206.0, 12, 6])]
+    assert list(deduplicator.filter(stream)) == PACKAGES[:2], (
+        'Повторные пакеты должны отсеиваться.'
+    )
+    assert (deduplicator.passed, deduplicator.duplicates) == (2, 2)
+    now[0] = 7
+    assert list(deduplicator.filter(PACKAGES[:1])) == []
+    now[0] = 20
+    assert list(deduplicator.filter(PACKAGES[:1])) == PACKAGES[:1], (
+        'Пакеты старше окна должны пропускаться снова.'
+    )
+
+
+def test_Deduplicator_shares_package_key():
+    deduplicator = homework.Deduplicator()
+    assert not deduplicator.seen(*PACKAGES[0])
+    assert deduplicator.recent.popitem()[0] == homework.package_key(
+        *PACKAGES[0])
+    with pytest.raises(ValueError):
+        deduplicator.seen('WLK', [9000, 1, 75])
+
+
+def test_Deduplicator_false_positive_rate():
+    deduplicator = homework.Deduplicator(
+        memory_bytes=4096 + 16 * homework.Deduplicator.EXACT_ENTRY_BYTES,
+        exact_size=16, window=math.inf)
+    packages = [('RUN', [action, 1, 75]) for action in range(4000)]
+    passed = sum(1 for _ in deduplicator.filter(packages))
+    observed = 1 - passed / len(packages)
+    estimate = deduplicator.false_positive_rate()
+    assert 0 < estimate < 0.2
+    assert observed <= estimate * 1.5, (
+        f'Наблюдаемая доля ложных повторов {observed:.4f} '
+        f'превышает оценку {estimate:.4f}.'
+    )
+
+
+def test_Deduplicator_memory_budget():
+    memory_bytes = 64 * 1024
+    homework.package_key(*PACKAGES[0])
+    tracemalloc.start()
+    deduplicator = homework.Deduplicator(memory_bytes=memory_bytes)
+    for action in range(20_000):
+        deduplicator.seen('RUN', [action, 1, 75])
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert used < memory_bytes * 1.1, (
+        f'Отсев занимает {used} байт при лимите {memory_bytes}.'
+    )
+    with pytest.raises(ValueError):
+        homework.Deduplicator(memory_bytes=4096, exact_size=4096)
+
+
+def test_Deduplicator_constant_memory():
+    def peak(count):
+        deduplicator = homework.Deduplicator(memory_bytes=1 << 16,
+                                             exact_size=100)
+        tracemalloc.start()
+        packages = (('RUN', [action, 1, 75]) for action in range(count))
+        for _ in deduplicator.filter(packages):
+            pass
+        result = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return result
+
+    assert peak(10_000) < peak(1_000) * 1.1, (
+        'Память отсева не должна расти с длиной потока.'
+    )
+
+
+@pytest.mark.parametrize('threads, chunk_size', [(1, 5), (4, 3), (3, 100)])
+def test_threaded_messages(threads, chunk_size):
+    packages = PACKAGES * 50
+    expected = [info.get_message()
+                for info in homework.stream_info(packages)]
+    result = list(homework.threaded_messages(iter(packages), threads,
+                                             chunk_size))
+    assert result == expected, (
+        'Потоковая обработка должна сохранять порядок и результаты.'
+    )
+
+
+def test_steal_work():
+    queues = [deque(), deque([(0, PACKAGES[:1]),
+                                               (1, PACKAGES[1:])])]
+    results = [None, None]
+    homework._steal_work(0, queues, results)
+    assert not any(queues), 'Поток должен забрать работу из чужой очереди.'
+    assert [len(lines) for lines in results] == [1, len(PACKAGES) - 1]
+
+
+def test_Leaderboard_matches_exact():
+    rng = random.Random(22)
+    messages = [
+        homework.InfoMessage(rng.choice(['Running', 'Swimming']),
+                             rng.uniform(0.5, 2), rng.uniform(1, 20),
+                             rng.lognormvariate(1.5, 0.5),
+                             rng.uniform(50, 900))
+        for _ in range(60_000)
+    ]
+    leaderboard = homework.Leaderboard(k=100).consume(messages)
+    for training_type in ('Running', 'Swimming'):
+        selected = [info for info in messages
+                    if info.training_type == training_type]
+        exact_top = sorted(selected, key=lambda info: -info.calories)[:100]
+        assert leaderboard.get_top(training_type) == exact_top, (
+            'Топ-K должен совпадать с точной сортировкой.'
+        )
+        speeds = sorted(info.speed for info in selected)
+        for q in (0.5, 0.95, 0.99):
+            estimate = leaderboard.get_quantile(training_type, q)
+            rank = bisect.bisect_left(speeds, estimate) / len(speeds)
+            assert abs(rank - q) < 0.02, (
+                f'Ошибка ранга квантиля {q} превышает 2%: {rank:.4f}.'
+            )
+
+
+def test_QuantileSketch_memory_bound():
+    sketch = homework.QuantileSketch(k=100, seed=1)
+    for value in range(200_000):
+        sketch.update(value)
+    assert sketch.count == 200_000
+    assert sketch.size <= sketch.max_size < 400, (
+        'Эскиз должен хранить O(k) значений.'
+    )
+    assert abs(sketch.quantile(0.5) - 100_000) < 200_000 * 0.03
+    with pytest.raises(ValueError):
+        homework.QuantileSketch().quantile(0.5)
+
+
+def test_SharedResults():
+    messages = list(homework.stream_info(PACKAGES))
+    with homework.SharedResults(8) as results:
+        assert results.write(3, messages) == len(messages)
+        views = list(results.views(3, len(messages)))
+        for view, info in zip(views, messages):
+            assert view.get_message() == info.get_message()
+            assert view.training_type == info.training_type
+            assert view.calories == info.calories
+            assert view.to_info() == info
+        other = homework.SharedResults(0, results.name)
+        assert next(other.views(3, 1)).to_info() == messages[0], (
+            'Записи должны быть видны при подключении по имени.'
+        )
+        other.close()
+
+
+def test_shared_parallel_info():
+    packages = PACKAGES * 9
+    expected = [info.get_message()
+                for info in homework.stream_info(packages)]
+    result = [view.get_message() for view in homework.shared_parallel_info(
+        iter(packages), workers=2, chunk_size=5)]
+    assert result == expected, (
+        'Результаты из общей памяти должны совпадать с обычным расчётом.'
+    )
+
+
+def test_PackageGenerator_reproducible():
+    pytest.importorskip('numpy')
+    first = list(homework.PackageGenerator(seed=5).packages(1000))
+    assert first == list(homework.PackageGenerator(seed=5).packages(1000)), (
+        'Генератор с одним seed должен выдавать одинаковый поток.'
+    )
+    assert first != list(homework.PackageGenerator(seed=6).packages(1000))
+    for package in first[:50]:
+        homework.read_package(*package).show_training_info()
+
+
+def test_PackageGenerator_rates():
+    pytest.importorskip('numpy')
+    generator = homework.PackageGenerator(
+        seed=3, mix={'RUN': 0.7, 'SWM': 0.3}, duplicate_rate=0.2,
+        malformed_rate=0.05, chunk_size=10_000
+    )
+    packages = list(generator.packages(50_000))
+    counts = collections.Counter(workout_type for workout_type, _ in packages)
+    assert counts['RUN'] / len(packages) == pytest.approx(0.7, abs=0.02)
+    assert set(counts) == {'RUN', 'SWM'}
+    unique = len({(workout_type, tuple(data))
+                  for workout_type, data in packages})
+    assert 1 - unique / len(packages) == pytest.approx(0.2, abs=0.02), (
+        'Доля повторов должна соответствовать duplicate_rate.'
+    )
+    validator = homework.PackageValidator()
+    valid = sum(1 for _ in validator.validate(packages))
+    assert 1 - valid / len(packages) == pytest.approx(0.05, abs=0.01), (
+        'Доля некорректных пакетов должна соответствовать malformed_rate.'
+    )
+
+
+def test_PackageGenerator_binary_and_columns(tmp_path):
+    pytest.importorskip('numpy')
+    path = tmp_path / 'packages.bin'
+    generator = homework.PackageGenerator(seed=9, chunk_size=300)
+    assert generator.write_binary(path, 1000) == 1000
+    assert list(homework.read_binary_packages(path)) == list(
+        generator.packages(1000)
+    )
+    total = 0
+    for workout_type, columns in generator.columns(1000):
+        distance, _, _ = homework.compute_batch(workout_type, columns)
+        total += len(distance)
+    assert total == len(homework.memmap_binary_packages(path)) == 1000